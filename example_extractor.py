@@ -1,13 +1,335 @@
 # example_extractor.py
 import os
+import re
 import json
 import time
+import asyncio
+import bisect
+import hashlib
+import sqlite3
+from collections import Counter
 from datetime import datetime
+from functools import lru_cache
+import ijson
+import orjson
 import google.generativeai as genai
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+# Markers that a page contains worked examples (one combined scan per page)
+_INDICATOR_RE = re.compile('|'.join(map(re.escape, ['ઉદાહરણ', 'Example', 'ઉકેલ', 'હલ'])))
+
+# Answer patterns in priority order: "∴ x = 8", "જવાબ:", "ઉકેલ:", equations.
+# Each is paired with a substring every match must contain, so pages without it
+# skip the regex and pay only for a plain substring search.
+_ANSWER_RES = [(needle, re.compile(pattern, re.MULTILINE)) for needle, pattern in (
+    ('∴', r'∴\s*([^.]+)'),
+    ('જવાબ', r'જવાબ\s*:?\s*([^.]+)'),
+    ('ઉકેલ', r'ઉકેલ\s*:?\s*([^.]+)'),
+    ('=', r'x\s*=\s*\d+.*y\s*=\s*\d+'),
+    ('=', r'\w+\s*=\s*\d+[^.]*')
+)]
+
+# Reference numbers like "3.1" in કોષ્ટક 3.1
+_REF_NUM_RE = re.compile(r'\d+\.\d+')
+
+# Specific visual references (કોષ્ટક 3.1, આકૃતિ 3.2, etc.) and simple linear equations
+_REF_PATTERN_RE = re.compile(r'(કોષ્ટક|આકૃતિ|ચિત્ર|આલેખ)\s*\d+\.\d+')
+_EQ_RE = re.compile(r'\d*[xy]\s*[+\-]\s*\d*[xy]\s*=\s*\d+')
+
+# Keywords that indicate mathematical content, matched in a single pass over the text.
+# The lookahead reports overlapping occurrences, like a multi-pattern automaton would.
+_MATH_KEYWORDS = (
+    'સમીકરણ', 'કોષ્ટક', 'આકૃતિ', 'આલેખ', 'ગ્રાફ', 'રેખા', 'બિંદુ',
+    'ઉકેલ', 'હલ', 'સંખ્યા', 'મૂલ્ય', 'છેદ', 'intersection', 'coordinate'
+)
+_MATH_KEYWORD_RE = re.compile('(?=(' + '|'.join(map(re.escape, _MATH_KEYWORDS)) + '))')
+
+def _keyword_hits(text_lower):
+    """Set of math keywords present in already-lowercased text"""
+    return frozenset(_MATH_KEYWORD_RE.findall(text_lower))
+
+def _match_features(text, text_lower=None):
+    """(keyword hits, visual references, has equation) for one example or image text"""
+    if text_lower is None:
+        text_lower = text.lower()
+    return (
+        _keyword_hits(text_lower),
+        frozenset(_REF_PATTERN_RE.findall(text)),
+        _EQ_RE.search(text) is not None
+    )
+
+@lru_cache(maxsize=4096)
+def _image_features(desc):
+    """(lowercased, visual references, has equation) for an image description
+    
+    Keyed by the description itself (image dicts aren't hashable), so an image
+    seen by several examples or neighbouring pages is scanned only once.
+    """
+    return desc.lower(), frozenset(_REF_PATTERN_RE.findall(desc)), _EQ_RE.search(desc) is not None
+
+def _image_match_features(desc):
+    """_match_features for an image description, built from the cached _image_features"""
+    desc_lower, refs, has_equation = _image_features(desc)
+    return _keyword_hits(desc_lower), refs, has_equation
+
+def _relevance_score(common_keywords, common_refs, has_equation):
+    """Weighted example/image relevance from pair features, capped at 1.0
+    
+    Pure arithmetic - all regex/keyword matching happens before this is called.
+    """
+    score = 0.2 * common_keywords + 0.4 * common_refs
+    if has_equation:
+        score += 0.3
+    return min(score, 1.0)
+
+def _shingles(text, size=5):
+    """Character n-grams of whitespace-normalized text (works for Gujarati without a tokenizer)"""
+    normalized = " ".join(text.split())
+    return frozenset(normalized[i:i + size] for i in range(max(len(normalized) - size + 1, 1)))
+
+def _find_matching_visual_description(visual_reference, visual_type, page_images, image_descs=None):
+    """Find matching image description based on reference and type
+    
+    image_descs is an optional list of (description, lowercased description)
+    per image, so callers looping over many visuals lowercase only once.
+    """
+    if image_descs is None:
+        image_descs = [
+            (desc, _image_features(desc)[0])
+            for desc in (image.get('educational_description', '') for image in page_images)
+        ]
+    
+    # Method 1: Exact reference matching (કોષ્ટક 3.1, આકૃતિ 3.2)
+    if visual_reference:
+        ref_match = _REF_NUM_RE.search(visual_reference)
+        if ref_match:
+            ref_number = ref_match.group()
+            ref_type = visual_reference.split()[0]  # કોષ્ટક, આકૃતિ
+            
+            for img_desc, _ in image_descs:
+                if ref_number in img_desc and ref_type in img_desc:
+                    return img_desc
+    
+    # Method 2: Type-based matching
+    visual_type_lower = visual_type.lower()
+    
+    type_keywords = {
+        'કોષ્ટક': ['કોષ્ટક', 'table'],
+        'આકૃતિ': ['આકૃતિ', 'આલેખ', 'graph'],
+        'ચિત્ર': ['ચિત્ર', 'diagram', 'figure']
+    }
+    
+    if visual_type_lower in type_keywords:
+        keywords = type_keywords[visual_type_lower]
+        
+        for img_desc, img_desc_lower in image_descs:
+            if any(keyword in img_desc_lower for keyword in keywords):
+                return img_desc
+    
+    return None
+
+def _enhance_examples_with_visual_content(examples, page_data):
+    """Add actual image descriptions to mentioned visual references"""
+    
+    page_images = page_data.get('images', [])
+    if not page_images:
+        return examples
+    
+    # Lowercase each image description once per page, not once per visual
+    image_descs = [
+        (desc, _image_features(desc)[0])
+        for desc in (image.get('educational_description', '') for image in page_images)
+    ]
+    
+    for example in examples:
+        mentioned_visuals = example.get('mentioned_visuals', [])
+        
+        for visual in mentioned_visuals:
+            visual_ref = visual.get('reference', '')
+            visual_type = visual.get('type', '')
+            
+            # Find matching description from page images
+            matching_desc = _find_matching_visual_description(
+                visual_ref, visual_type, page_images, image_descs=image_descs
+            )
+            
+            if matching_desc:
+                visual['full_description'] = matching_desc
+                print(f"    ✅ Found description for {visual_ref}")
+            else:
+                visual['full_description'] = "વર્ણન ઉપલબ્ધ નથી"
+                print(f"    ⚠️ No description found for {visual_ref}")
+    
+    return examples
+
+def _build_json_value(event, value, events):
+    """Build the JSON value starting at (event, value), consuming its remaining ijson events"""
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    depth = 1 if event in ('start_map', 'start_array') else 0
+    while depth:
+        _, event, value = next(events)
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+    return builder.value
+
+def _read_json_sections(events, sections):
+    """Read top-level sections into `sections` until the page array (True) or the end of the document (False)"""
+    for prefix, event, key in events:
+        if prefix == '' and event == 'map_key':
+            _, event, value = next(events)
+            if key == 'pages' and event == 'start_array':
+                return True
+            sections[key] = _build_json_value(event, value, events)
+    return False
+
+class _PageStream:
+    """Pages of a processed JSON, streamed from disk in the same pass that read the sections before them
+    
+    Iterable once - a second iteration raises instead of silently yielding nothing -
+    and has no len(); `count` is the number of pages read so far. Any sections after
+    the page array are merged into `sections` once the stream gets past the pages.
+    """
+    def __init__(self, f, events, sections):
+        self.f = f
+        self.events = events
+        self.sections = sections
+        self.count = 0
+        self.started = False
+
+    def __iter__(self):
+        if self.started:
+            raise RuntimeError("processed JSON pages can only be iterated once")
+        self.started = True
+        
+        with self.f:
+            if self.events is None:
+                return
+            for _, event, value in self.events:
+                if event == 'end_array':
+                    break
+                yield _build_json_value(event, value, self.events)
+                self.count += 1
+            _read_json_sections(self.events, self.sections)
+
+class LLMCache:
+    """Persistent prompt -> response cache backed by SQLite
+    
+    Two tiers: an exact tier keyed by prompt hash, and a similarity tier that
+    matches page texts whose shingle overlap (Jaccard) is above the threshold,
+    so re-OCR'd pages with trivial differences reuse the earlier response.
+    Similarity entries are scoped (chapter + prompt template hash), so a page
+    only matches responses produced by the same prompt.
+    """
+    def __init__(self, db_path, similarity_threshold=0.95):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_texts ("
+            "scope TEXT NOT NULL, page_text TEXT NOT NULL, response TEXT NOT NULL, created_at TEXT NOT NULL)"
+        )
+        # Caches from before scoping have no scope column - their rows can't be
+        # attributed to a prompt, so they get an empty scope that never matches
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(page_texts)")]
+        if "scope" not in columns:
+            self.conn.execute("ALTER TABLE page_texts ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self.conn.commit()
+        
+        self.similarity_threshold = similarity_threshold
+        # scope -> (sorted shingle counts, [(shingles, response)] in the same order),
+        # so a lookup only visits entries whose size could reach the threshold
+        self.similar_entries = {}
+        for scope, page_text, response in self.conn.execute(
+            "SELECT scope, page_text, response FROM page_texts WHERE scope != ''"
+        ):
+            self._index_similar(scope, page_text, response)
+
+    @staticmethod
+    def make_key(prompt):
+        """SHA-256 of the full prompt, so any prompt change is a new entry"""
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, response):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, datetime.now().isoformat())
+        )
+        self.conn.commit()
+
+    def find_similar(self, scope, page_text):
+        """Return the cached response for the most similar stored page in scope, if similar enough"""
+        if scope not in self.similar_entries:
+            return None
+        
+        query = _shingles(page_text)
+        sizes, entries = self.similar_entries[scope]
+        best_score, best_response = 0.0, None
+        
+        # Jaccard can never exceed the size ratio, so only pages within
+        # [threshold * n, n / threshold] shingles can match
+        start = bisect.bisect_left(sizes, self.similarity_threshold * len(query))
+        end = bisect.bisect_right(sizes, len(query) / self.similarity_threshold)
+        for shingles, response in entries[start:end]:
+            score = len(query & shingles) / len(query | shingles)
+            if score > best_score:
+                best_score, best_response = score, response
+        
+        return best_response if best_score >= self.similarity_threshold else None
+
+    def add_similar(self, scope, page_text, response):
+        self.conn.execute(
+            "INSERT INTO page_texts (scope, page_text, response, created_at) VALUES (?, ?, ?, ?)",
+            (scope, page_text, response, datetime.now().isoformat())
+        )
+        self.conn.commit()
+        self._index_similar(scope, page_text, response)
+
+    def _index_similar(self, scope, page_text, response):
+        shingles = _shingles(page_text)
+        sizes, entries = self.similar_entries.setdefault(scope, ([], []))
+        position = bisect.bisect_right(sizes, len(shingles))
+        sizes.insert(position, len(shingles))
+        entries.insert(position, (shingles, response))
+
+class AsyncRateLimiter:
+    """Spaces request start times at least 1/max_per_second apart"""
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second
+        self.next_slot = 0.0
+
+    async def wait(self):
+        # No await between reading and reserving the slot, so no lock is needed
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
 class GSEBExampleExtractor:
+    # Phrase found in a chapter summary -> canonical chapter name
+    _CHAPTER_PATTERNS = {
+        'દ્વિચલ સુરેખ સમીકરણ': 'દ્વિચલ સુરેખ સમીકરણયુગ્મ',
+    }
+    # All phrases in one pass over the summary; longest first so it wins on overlap
+    _CHAPTER_RE = re.compile('|'.join(
+        map(re.escape, sorted(_CHAPTER_PATTERNS, key=len, reverse=True))
+    ))
+
     def __init__(self):
         # Load environment variables
         load_dotenv()
@@ -23,19 +345,43 @@ class GSEBExampleExtractor:
         # API call counter
         self.api_calls = {"gemini_api": 0}
         
+        # Response cache - reruns over the same pages skip the Gemini call
+        self.cache = LLMCache(os.getenv('EXAMPLE_CACHE_PATH', '.llm_cache/examples.sqlite'))
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0}
+        
+        # Concurrency limits for Gemini calls (replaces the fixed sleep between pages)
+        self.rate_limiter = AsyncRateLimiter(max_per_second=5)
+        self.max_concurrent_requests = 8
+        
+        # Several pages share one prompt; ~30k input tokens keeps the output within limits
+        self.max_batch_tokens = 30000
+        self.max_pages_per_batch = 4
+        
         print("📚 Initialized GSEB Example Extractor")
         print(f"🔑 Gemini API Key: {'✅ Loaded' if gemini_api_key else '❌ Missing'}")
 
     def load_processed_json(self, json_file_path):
-        """Load processed JSON from main.py output"""
+        """Load processed JSON from main.py output
+        
+        The file is read in a single pass: sections before the page array (main.py
+        writes metadata and chapter_info first) are parsed here, and 'pages' is a
+        _PageStream that yields one page at a time from disk. It can be iterated
+        only once and has no len().
+        """
         print(f"\n📂 Loading processed JSON: {json_file_path}")
         
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        f = open(json_file_path, 'rb')
+        events = ijson.parse(f, use_float=True)
+        data = {}
+        has_pages = _read_json_sections(events, data)
+        data["pages"] = _PageStream(f, events if has_pages else None, data)
+        
+        data.setdefault("metadata", {})
+        data.setdefault("chapter_info", {})
         
         print(f"📊 Loaded data:")
-        print(f"  📄 Total pages: {len(data.get('pages', []))}")
-        print(f"  📚 Chapter: {data.get('metadata', {}).get('source_pdf', 'Unknown')}")
+        print(f"  📄 Total pages: {data['metadata'].get('total_pages', 'Unknown')}")
+        print(f"  📚 Chapter: {data['metadata'].get('source_pdf', 'Unknown')}")
         
         return data
 
@@ -51,133 +397,126 @@ class GSEBExampleExtractor:
         
         all_examples = []
         
-        for page in tqdm(pages_data, desc="🔍 Extracting examples"):
-            try:
-                page_number = page.get('page_number', 0)
-                page_text = page.get('text', '')
-                
-                if len(page_text) < 100:
-                    continue
-                    
-                # Check for example indicators
-                example_indicators = ['ઉદાહરણ', 'Example', 'ઉકેલ', 'હલ']
-                if not any(indicator in page_text for indicator in example_indicators):
-                    continue
-                
-                # Step 1: Extract examples with AI
-                examples = self._extract_examples_with_ai(page_text, chapter_name, page_number)
-                
-                if examples:
-                    # Step 2: Enhance with visual descriptions
-                    examples = self._enhance_examples_with_visual_content(examples, page)
-                    
-                    for example in examples:
-                        visuals_count = len(example.get('mentioned_visuals', []))
-                        print(f"    📝 Example {example.get('example_number', '')}: {visuals_count} visual references")
-                    
-                    all_examples.extend(examples)
-                
-                time.sleep(1)
+        # Only pages with example indicators are sent to Gemini (and kept in memory)
+        eligible_pages = [
+            page for page in tqdm(pages_data, desc="📄 Scanning pages")
+            if len(page.get('text', '')) >= 100 and _INDICATOR_RE.search(page.get('text', ''))
+        ]
+        
+        # Step 1: Extract examples with AI (concurrent, rate limited)
+        page_results = asyncio.run(self._extract_pages_concurrently(eligible_pages, chapter_name))
+        
+        # Step 2: Enhance with visual descriptions (local CPU work)
+        jobs = [(examples, page) for page, examples in zip(eligible_pages, page_results) if examples]
+        
+        # Statistics are tallied in the same pass, binding each example's visuals once
+        total_visuals = 0
+        visuals_with_descriptions = 0
+        
+        for examples in self._enhance_pages(jobs):
+            if examples is None:
+                continue
+            
+            for example in examples:
+                mentioned_visuals = example.get('mentioned_visuals', [])
+                visuals_count = len(mentioned_visuals)
+                print(f"    📝 Example {example.get('example_number', '')}: {visuals_count} visual references")
                 
-            except Exception as e:
-                print(f"  ❌ Error on page {page_number}: {str(e)[:100]}...")
+                total_visuals += visuals_count
+                visuals_with_descriptions += sum(
+                    1 for v in mentioned_visuals if v.get('full_description') != "વર્ણન ઉપલબ્ધ નથી"
+                )
+            
+            all_examples.extend(examples)
         
         print(f"\n📚 EXTRACTION COMPLETED")
         print(f"🔍 Total examples: {len(all_examples)}")
         
-        # Statistics
-        total_visuals = sum(len(ex.get('mentioned_visuals', [])) for ex in all_examples)
-        visuals_with_descriptions = sum(
-            sum(1 for v in ex.get('mentioned_visuals', []) if v.get('full_description') != "વર્ણન ઉપલબ્ધ નથી") 
-            for ex in all_examples
-        )
-        
         print(f"📊 Visual References:")
         print(f"  📝 Total mentioned: {total_visuals}")
         print(f"  📄 With descriptions: {visuals_with_descriptions}")
+        print(f"💾 Cache: {self.stats['hits']} hits, {self.stats['similar_hits']} similar-page hits, "
+              f"{self.stats['misses']} misses")
         
         return all_examples
 
 
-    def _find_matching_visual_description(self, visual_reference, visual_type, page_images):
-        """Find matching image description based on reference and type"""
-        import re
-        
-        # Method 1: Exact reference matching (કોષ્ટક 3.1, આકૃતિ 3.2)
-        if visual_reference:
-            ref_match = re.search(r'\d+\.\d+', visual_reference)
-            if ref_match:
-                ref_number = ref_match.group()
-                ref_type = visual_reference.split()[0]  # કોષ્ટક, આકૃતિ
-                
-                for image in page_images:
-                    img_desc = image.get('educational_description', '')
-                    if ref_number in img_desc and ref_type in img_desc:
-                        return img_desc
-        
-        # Method 2: Type-based matching
-        visual_type_lower = visual_type.lower()
-        
-        type_keywords = {
-            'કોષ્ટક': ['કોષ્ટક', 'table'],
-            'આકૃતિ': ['આકૃતિ', 'આલેખ', 'graph'],
-            'ચિત્ર': ['ચિત્ર', 'diagram', 'figure']
-        }
+    async def _extract_pages_concurrently(self, pages, chapter_name):
+        """Run Gemini extraction for all pages concurrently; results keep page order"""
+        page_examples = {}
+        pending = []
+        for page in pages:
+            page_number = page.get('page_number', 0)
+            examples = self._get_cached_examples(page.get('text', ''), chapter_name, page_number)
+            if examples is None:
+                pending.append((page_number, page.get('text', '')))
+            else:
+                page_examples[page_number] = examples
+        
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        progress = tqdm(total=len(pages), initial=len(pages) - len(pending), desc="🔍 Extracting examples")
+        
+        async def extract(batch):
+            async with semaphore:
+                batch_examples = await self._extract_examples_with_ai(batch, chapter_name)
+            page_examples.update(batch_examples)
+            progress.update(len(batch))
         
-        if visual_type_lower in type_keywords:
-            keywords = type_keywords[visual_type_lower]
-            
-            for image in page_images:
-                img_desc = image.get('educational_description', '').lower()
-                if any(keyword in img_desc for keyword in keywords):
-                    return image.get('educational_description', '')
-        
-        return None
+        try:
+            await asyncio.gather(*(extract(batch) for batch in self._batch_pages(pending)))
+        finally:
+            progress.close()
+        
+        # Add metadata (one timestamp for everything from this run)
+        now_iso = datetime.now().isoformat()
+        results = []
+        for page in pages:
+            page_number = page.get('page_number', 0)
+            examples = page_examples.get(page_number, [])
+            for example in examples:
+                if isinstance(example, dict):
+                    example["page_number"] = page_number
+                    example["chapter"] = chapter_name
+                    example["extracted_at"] = now_iso
+                    example["source"] = "example"
+                    example["status"] = "inactive"
+            results.append(examples)
+        return results
 
-    def _enhance_examples_with_visual_content(self, examples, page_data):
-        """Add actual image descriptions to mentioned visual references"""
-        
-        page_images = page_data.get('images', [])
-        if not page_images:
-            return examples
-        
-        for example in examples:
-            mentioned_visuals = example.get('mentioned_visuals', [])
-            
-            for visual in mentioned_visuals:
-                visual_ref = visual.get('reference', '')
-                visual_type = visual.get('type', '')
-                
-                # Find matching description from page images
-                matching_desc = self._find_matching_visual_description(
-                    visual_ref, visual_type, page_images
-                )
-                
-                if matching_desc:
-                    visual['full_description'] = matching_desc
-                    print(f"    ✅ Found description for {visual_ref}")
-                else:
-                    visual['full_description'] = "વર્ણન ઉપલબ્ધ નથી"
-                    print(f"    ⚠️ No description found for {visual_ref}")
-        
-        return examples
+    def _batch_pages(self, pages):
+        """Group (page_number, page_text) pairs into prompts of at most max_batch_tokens"""
+        batch, batch_tokens = [], 0
+        for page_number, page_text in pages:
+            # Rough estimate: ~4 characters per token
+            page_tokens = len(page_text) // 4
+            if batch and (batch_tokens + page_tokens > self.max_batch_tokens
+                          or len(batch) >= self.max_pages_per_batch):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append((page_number, page_text))
+            batch_tokens += page_tokens
+        if batch:
+            yield batch
 
+    def _enhance_pages(self, jobs):
+        """Enhance (examples, page) jobs; returns results in job order, None for failed pages"""
+        # Runs in-process: enhancement is ~0.3 ms per page, far below the start-up
+        # cost of a process pool for any realistic chapter
+        results = []
+        for examples, page in jobs:
+            try:
+                results.append(_enhance_examples_with_visual_content(examples, page))
+            except Exception as e:
+                print(f"  ❌ Error on page {page.get('page_number', 0)}: {str(e)[:100]}...")
+                results.append(None)
+        return results
 
     def _extract_final_answer_from_text(self, page_text, example_text):
         """Extract the final numerical answer from the solution"""
-        import re
-        
-        # Look for patterns like "∴ x = 8", "જવાબ:", "ઉકેલ:", etc.
-        answer_indicators = [
-            r'∴\s*([^.]+)',
-            r'જવાબ\s*:?\s*([^.]+)',
-            r'ઉકેલ\s*:?\s*([^.]+)',
-            r'x\s*=\s*\d+.*y\s*=\s*\d+',
-            r'\w+\s*=\s*\d+[^.]*'
-        ]
-        
-        for pattern in answer_indicators:
-            matches = re.findall(pattern, page_text, re.MULTILINE)
+        for needle, pattern in _ANSWER_RES:
+            if needle not in page_text:
+                continue
+            matches = pattern.findall(page_text)
             if matches:
                 # Return the most complete numerical answer
                 for match in matches:
@@ -188,12 +527,14 @@ class GSEBExampleExtractor:
 
 
 
-    def _extract_examples_with_ai(self, page_text, chapter_name, page_number):
-        """Extract examples with example numbers and mentioned visual references"""
+    def _build_prompt(self, chapter_name, pages):
+        """Prompt asking for the examples on each of the (page_number, page_text) pages"""
+        pages_text = "\n".join(
+            f"--- પાનું {page_number} ---\n{page_text}\n" for page_number, page_text in pages
+        )
         
-    
-        prompt = f"""
-        તમે ધોરણ 10 ગણિતના અધ્યાય "{chapter_name}" ના પાના {page_number} માંથી **ઉદાહરણો** શોધી રહ્યા છો.
+        return f"""
+        તમે ધોરણ 10 ગણિતના અધ્યાય "{chapter_name}" ના નીચે આપેલા પાનાઓ માંથી **ઉદાહરણો** શોધી રહ્યા છો.
         
         દરેક ઉદાહરણ માટે:
         1. **example_number**: "ઉદાહરણ 19" વગેરે
@@ -205,39 +546,86 @@ class GSEBExampleExtractor:
         - "ઉકેલ:", "જવાબ:", "∴" પછી આવતો ભાગ એ અંતિમ જવાબ છે
         - સમીકરણો અને ગણતરીઓ explanation માં સામેલ કરો
         - Answer માં ચોક્કસ આંકડાકીય મૂલ્યો આપો, પ્રશ્ન પુનરાવર્તન નહીં
+        - દરેક ઉદાહરણ જે પાના પર છે તે પાનાના page_number હેઠળ જ આપો
         
-        પાનાનું ટેક્સ્ટ:
-        {page_text}
+        પાનાઓનું ટેક્સ્ટ:
+        {pages_text}
         
-        JSON ફોર્મેટ:
+        JSON ફોર્મેટ (દરેક પાના માટે એક entry):
         [
         {{
-            "example_number": "ઉદાહરણ 19",
-            "question": "એક હોડી નદીના સામા પ્રવાહે 30 કિમી અને પ્રવાહની દિશામાં 44 કિમી અંતર 10 કલાકમાં કાપે છે...",
-            "answer": "હોડીની સ્થિર પાણીમાં ઝડપ = 8 કિમી/કલાક, નદીના પ્રવાહની ઝડપ = 3 કિમી/કલાક",
-            "explanation": "ધારો કે હોડીની સ્થિર પાણીમાં ઝડપ x કિમી/કલાક અને પ્રવાહની ઝડપ y કિમી/કલાક છે. સમીકરણો: 30/(x-y) + 44/(x+y) = 10...",
-            "question_type": "Long Answer",
-            "mentioned_visuals": [
+            "page_number": 42,
+            "examples": [
             {{
-                "type": "કોષ્ટક/આકૃતિ/ચિત્ર",
-                "reference": "કોષ્ટક 3.1",
-                "context": "શા માટે જરૂરી છે"
+                "example_number": "ઉદાહરણ 19",
+                "question": "એક હોડી નદીના સામા પ્રવાહે 30 કિમી અને પ્રવાહની દિશામાં 44 કિમી અંતર 10 કલાકમાં કાપે છે...",
+                "answer": "હોડીની સ્થિર પાણીમાં ઝડપ = 8 કિમી/કલાક, નદીના પ્રવાહની ઝડપ = 3 કિમી/કલાક",
+                "explanation": "ધારો કે હોડીની સ્થિર પાણીમાં ઝડપ x કિમી/કલાક અને પ્રવાહની ઝડપ y કિમી/કલાક છે. સમીકરણો: 30/(x-y) + 44/(x+y) = 10...",
+                "question_type": "Long Answer",
+                "mentioned_visuals": [
+                {{
+                    "type": "કોષ્ટક/આકૃતિ/ચિત્ર",
+                    "reference": "કોષ્ટક 3.1",
+                    "context": "શા માટે જરૂરી છે"
+                }}
+                ]
             }}
             ]
         }}
         ]
         
-        જો કોઈ ઉદાહરણ ન હોય તો [] આપો.
-        """ 
+        જે પાનામાં કોઈ ઉદાહરણ ન હોય તેના માટે "examples": [] આપો.
+        """
+
+    def _get_cached_examples(self, page_text, chapter_name, page_number):
+        """Return cached examples for a page, or None if it still needs a Gemini call"""
+        # Cache entries are per page, keyed on the page's own single-page prompt
+        cache_key = LLMCache.make_key(self._build_prompt(chapter_name, [(page_number, page_text)]))
+        cached_text = self.cache.get(cache_key)
+        similar = cached_text is None
+        if similar:
+            # Near-duplicate page (e.g. re-OCR'd) under the same chapter and prompt
+            cached_text = self.cache.find_similar(self._similar_scope(chapter_name), page_text)
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            examples = json.loads(cached_text) if cached_text is not None else None
+        except json.JSONDecodeError:
+            examples = None
+        if examples is None:
+            self.stats["misses"] += 1
+            return None
+        
+        if similar:
+            # Promote the near-duplicate's response to the exact tier
+            self.stats["similar_hits"] += 1
+            self.cache.set(cache_key, cached_text)
+        else:
+            self.stats["hits"] += 1
+        return examples if isinstance(examples, list) else []
+
+    def _similar_scope(self, chapter_name):
+        """Similarity-tier scope: hash of the chapter's prompt without any page text"""
+        return LLMCache.make_key(self._build_prompt(chapter_name, []))
+
+    async def _extract_examples_with_ai(self, pages, chapter_name):
+        """Extract examples from a batch of (page_number, page_text) pages in one Gemini call
+        
+        Returns {page_number: examples}. A batch whose JSON cannot be parsed (e.g. the
+        output was truncated) is split in half and retried so the other pages survive.
+        Pages missing from a parsed reply are re-requested on their own; a page that
+        is still missing is left out of the result (and the cache) so the next run
+        retries it.
+        """
+        prompt = self._build_prompt(chapter_name, pages)
+        
+        try:
+            await self.rate_limiter.wait()
+            response = await self.gemini_model.generate_content_async(prompt)
             self.api_calls["gemini_api"] += 1
-            
             response_text = response.text.strip()
             
             if not response_text:
-                return []
+                return {}
             
             # Clean markdown formatting
             if response_text.startswith("```"):
@@ -247,30 +635,62 @@ class GSEBExampleExtractor:
             
             response_text = response_text.strip()
             if not (response_text.startswith('[') or response_text.startswith('{')):
-                return []
-            
-            examples = json.loads(response_text)
-            
-            if not isinstance(examples, list):
-                return []
-            
-            # Add metadata
-            for example in examples:
-                if isinstance(example, dict):
-                    example["page_number"] = page_number
-                    example["chapter"] = chapter_name
-                    example["extracted_at"] = datetime.now().isoformat()
-                    example["source"] = "example"
-                    example["status"] = "inactive"
+                return {}
             
-            return examples
+            entries = json.loads(response_text)
             
         except json.JSONDecodeError:
-            print(f"  JSON parsing error on page {page_number}")
-            return []
+            if len(pages) > 1:
+                middle = len(pages) // 2
+                first = await self._extract_examples_with_ai(pages[:middle], chapter_name)
+                second = await self._extract_examples_with_ai(pages[middle:], chapter_name)
+                return {**first, **second}
+            print(f"  JSON parsing error on page {pages[0][0]}")
+            return {}
         except Exception as e:
-            print(f"  AI extraction error on page {page_number}: {str(e)[:50]}...")
-            return []
+            page_numbers = ", ".join(str(page_number) for page_number, _ in pages)
+            print(f"  AI extraction error on pages {page_numbers}: {str(e)[:50]}...")
+            return {}
+        
+        if isinstance(entries, dict):
+            entries = [entries]
+        if not isinstance(entries, list):
+            return {}
+        
+        # Gemini may echo page numbers back as strings. Only pages the reply actually
+        # has an entry for get a result - "examples": [] is an answer, absence is not.
+        page_lookup = {str(page_number): page_number for page_number, _ in pages}
+        page_examples = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            page_number = page_lookup.get(str(entry.get('page_number')))
+            examples = entry.get('examples')
+            if page_number is not None and isinstance(examples, list):
+                page_examples.setdefault(page_number, []).extend(examples)
+        
+        # Cache only the pages the reply answered, so dropped pages get retried
+        similar_scope = self._similar_scope(chapter_name)
+        answered_pages = [(page_number, page_text) for page_number, page_text in pages if page_number in page_examples]
+        for page_number, page_text in answered_pages:
+            examples_text = json.dumps(page_examples[page_number], ensure_ascii=False)
+            self.cache.set(
+                LLMCache.make_key(self._build_prompt(chapter_name, [(page_number, page_text)])),
+                examples_text
+            )
+            self.cache.add_similar(similar_scope, page_text, examples_text)
+        
+        missing_pages = [page for page in pages if page[0] not in page_examples]
+        if missing_pages and len(pages) > 1:
+            retried = await asyncio.gather(
+                *(self._extract_examples_with_ai([page], chapter_name) for page in missing_pages)
+            )
+            for page_result in retried:
+                page_examples.update(page_result)
+        elif missing_pages:
+            print(f"  ⚠️ Page {pages[0][0]} missing from the reply, will retry next run")
+        
+        return page_examples
 
 
 
@@ -279,30 +699,48 @@ class GSEBExampleExtractor:
         
         page_images = page_data.get('images', [])
         if not page_images:
+            # Nothing to detect: fill the output fields without entering the scoring pipeline
+            for example in examples:
+                example.setdefault('detected_visuals', [])
+                example['total_visual_references'] = len(example.get('mentioned_visuals', []))
             return examples
         
+        # Per-image fields and match features are computed once per page instead of
+        # once per (example, image) pair; each pair is then scored from these features
+        image_entries = []
+        for image in page_images:
+            image_desc = image.get('educational_description', '')
+            object_type = image.get('object_type', {})
+            
+            # Extract object description
+            if isinstance(object_type, dict):
+                obj_description = object_type.get('description', '')
+            else:
+                obj_description = str(object_type)
+            
+            # Lowercase once (cached); both match features and visual type derive from it
+            image_entries.append((
+                image, image_desc, obj_description, _image_match_features(image_desc),
+                self._classify_visual_type(image_desc, desc_lower=_image_features(image_desc)[0])
+            ))
+        
         for example in examples:
             example_full_text = f"{example.get('question', '')} {example.get('explanation', '')}"
+            example_features = _match_features(example_full_text)
             
             # Find relevant images based on content matching
             detected_visuals = []
             
-            for image in page_images:
-                image_desc = image.get('educational_description', '')
-                object_type = image.get('object_type', {})
-                
-                # Extract object description
-                if isinstance(object_type, dict):
-                    obj_description = object_type.get('description', '')
-                else:
-                    obj_description = str(object_type)
-                
+            for image, image_desc, obj_description, image_features, visual_type in image_entries:
                 # Check for relevance using keywords and context
-                relevance_score = self._calculate_image_relevance(example_full_text, image_desc, obj_description)
+                relevance_score = self._calculate_image_relevance(
+                    example_full_text, image_desc, obj_description,
+                    example_features=example_features, image_features=image_features
+                )
                 
                 if relevance_score > 0.3:  # Threshold for relevance
                     visual_info = {
-                        "type": self._classify_visual_type(image_desc),
+                        "type": visual_type,
                         "reference_id": image.get('reference_id', f"ચિત્ર_{example.get('page_number')}" ),
                         "description": image_desc,
                         "detection_method": image.get('detection_method', 'unknown'),
@@ -319,45 +757,36 @@ class GSEBExampleExtractor:
         
         return examples
 
-    def _calculate_image_relevance(self, example_text, image_desc, obj_description):
-        """Calculate relevance score between example and image"""
-        
-        # Keywords that indicate mathematical content
-        math_keywords = [
-            'સમીકરણ', 'કોષ્ટક', 'આકૃતિ', 'આલેખ', 'ગ્રાફ', 'રેખા', 'બિંદુ',
-            'ઉકેલ', 'હલ', 'સંખ્યા', 'મૂલ્ય', 'છેદ', 'intersection', 'coordinate'
-        ]
-        
-        score = 0
-        example_lower = example_text.lower()
-        image_desc_lower = image_desc.lower()
+    def _calculate_image_relevance(self, example_text, image_desc, obj_description,
+                                   example_features=None, image_features=None):
+        """Calculate relevance score between example and image
+        
+        Match features (see _match_features) can be passed in when the caller
+        has already computed them, leaving only set intersections per pair.
+        """
+        if example_features is None:
+            example_features = _match_features(example_text)
+        if image_features is None:
+            image_features = _image_match_features(image_desc)
+        example_hits, example_refs, example_has_eq = example_features
+        image_hits, image_refs, image_has_eq = image_features
         
         # Check for direct keyword matches
-        for keyword in math_keywords:
-            if keyword in example_lower and keyword in image_desc_lower:
-                score += 0.2
+        common_keywords = len(example_hits & image_hits)
         
         # Check for specific references (કોષ્ટક 3.1, આકૃતિ 3.2, etc.)
-        import re
-        ref_pattern = r'(કોષ્ટક|આકૃતિ|ચિત્ર|આલેખ)\s*\d+\.\d+'
-        
-        example_refs = re.findall(ref_pattern, example_text)
-        image_refs = re.findall(ref_pattern, image_desc)
-        
-        common_refs = set(example_refs) & set(image_refs)
-        score += len(common_refs) * 0.4
+        common_refs = len(example_refs & image_refs)
         
         # Check for equation mentions
-        equation_pattern = r'\d*[xy]\s*[+\-]\s*\d*[xy]\s*=\s*\d+'
-        if re.search(equation_pattern, example_text) and re.search(equation_pattern, image_desc):
-            score += 0.3
+        has_equation = example_has_eq and image_has_eq
         
-        return min(score, 1.0)  # Cap at 1.0
+        return _relevance_score(common_keywords, common_refs, has_equation)
 
-    def _classify_visual_type(self, image_description):
+    def _classify_visual_type(self, image_description, desc_lower=None):
         """Classify visual type based on description"""
         
-        desc_lower = image_description.lower()
+        if desc_lower is None:
+            desc_lower = image_description.lower()
         
         if 'કોષ્ટક' in desc_lower or 'table' in desc_lower:
             return 'કોષ્ટક'
@@ -377,8 +806,9 @@ class GSEBExampleExtractor:
         chapter_summary = json_data.get('chapter_info', {}).get('chapter_summary', '')
         
         # Look for chapter name patterns in summary
-        if 'દ્વિચલ સુરેખ સમીકરણ' in chapter_summary:
-            return 'દ્વિચલ સુરેખ સમીકરણયુગ્મ'
+        match = self._CHAPTER_RE.search(chapter_summary)
+        if match:
+            return self._CHAPTER_PATTERNS[match.group()]
         
         # Fallback: extract from filename
         source_pdf = json_data.get('metadata', {}).get('source_pdf', '')
@@ -398,14 +828,12 @@ class GSEBExampleExtractor:
             "examples": examples
         }
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        # orjson writes UTF-8 directly, so Gujarati text is stored unescaped
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         # Statistics
-        question_types = {}
-        for example in examples:
-            qtype = example.get('question_type', 'Unknown')
-            question_types[qtype] = question_types.get(qtype, 0) + 1
+        question_types = Counter(example.get('question_type', 'Unknown') for example in examples)
         
         print(f"✅ EXAMPLES SAVED SUCCESSFULLY")
         print(f"📊 Question Type Distribution:")
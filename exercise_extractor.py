@@ -1,12 +1,296 @@
 # exercise_extractor.py
 import os
-import json
+import re
 import time
-from datetime import datetime
+import random
+import asyncio
+import atexit
+import hashlib
+import logging
+import logging.handlers
+import argparse
+import queue
+import tempfile
+from collections import deque
+from datetime import datetime, timezone
+from typing import Literal
+import orjson
+from pydantic import BaseModel, TypeAdapter, ValidationError
 import google.generativeai as genai
+from google.generativeai.types import generation_types
+from google import genai as google_genai
+from google.genai import types as genai_types
+from google.api_core.exceptions import ResourceExhausted
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+# Per-page progress goes to this logger; main() routes it through a queue
+logger = logging.getLogger(__name__)
+
+# Exercise section headers with numbers (compiled once at import)
+_EXERCISE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'સ્વાધ્યાય\s+\d+\.\d+',      # સ્વાધ્યાય 3.1, સ્વાધ્યાય 2.5
+    r'અભ્યાસ\s+\d+\.\d+',         # અભ્યાસ 3.1
+    r'પ્રેક્ટિસ\s+\d+\.\d+',       # પ્રેક્ટિસ 3.1
+    r'Exercise\s+\d+\.\d+',        # Exercise 3.1
+    r'કસોટી\s+\d+\.\d+'           # કસોટી 3.1
+))
+
+# Numbered questions following an exercise indicator, as one alternation
+_QUESTIONS_AFTER = re.compile(
+    r'\n\s*\d+\.\s+'           # 1. 2. 3.
+    r'|\n\s*\(\s*[ivx]+\s*\)'  # (i) (ii) (iii)
+    r'|\n\s*[અઆઇ]\)\s+'        # અ) આ) ઇ)
+)
+
+# Reference numbers like "3.5" in આકૃતિ 3.5
+_REF_NUM = re.compile(r'\d+\.\d+')
+
+# Words identifying each visual type in an image description
+_VISUAL_TYPE_KEYWORDS = {
+    'આકૃતિ': ('આકૃતિ', 'figure', 'diagram'),
+    'આલેખ': ('આલેખ', 'graph', 'chart'),
+    'કોષ્ટક': ('કોષ્ટક', 'table')
+}
+
+# The 9 question types Gemini classifies into
+QUESTION_TYPES = (
+    "Very Short / Objective (O)",
+    "MCQs (Multiple Choice Questions)",
+    "True / False",
+    "Fill in the Blanks",
+    "Short Answer – I (SA-I)",
+    "Short Answer – II (SA-II)",
+    "Long Answer (LA)",
+    "Match the Values / (Jodka Jodo)",
+    "Diagram-Based"
+)
+
+class MentionedVisual(BaseModel):
+    """A figure, graph or table a question refers to"""
+    type: str
+    reference: str
+    context: str
+
+# Sent to Gemini as the response_schema (docstrings become schema descriptions)
+class ExerciseQuestion(BaseModel):
+    """One exercise question from the textbook page, with its answer and explanation"""
+    exercise_number: str
+    page_number: int
+    original_question_number: str
+    sub_question_number: str
+    question_text: str
+    question_type: Literal[QUESTION_TYPES]
+    answer: str
+    explanation: str
+    marks_estimate: int
+    difficulty: str
+    mentioned_visuals: list[MentionedVisual]
+
+_EXERCISE_LIST = TypeAdapter(list[ExerciseQuestion])
+
+class RateLimiter:
+    """
+    Sliding-window rate limiter shared by concurrent requests on one event loop
+    
+    Allows at most max_calls entries per period seconds; `async with`
+    waits until a slot is free.
+    """
+    
+    def __init__(self, max_calls, period=60):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = deque()
+    
+    def _reserve(self):
+        """Take a slot if one is free; otherwise return the seconds until one frees up"""
+        now = time.monotonic()
+        while self.calls and now - self.calls[0] >= self.period:
+            self.calls.popleft()
+        
+        if len(self.calls) < self.max_calls:
+            self.calls.append(now)
+            return 0
+        
+        return self.period - (now - self.calls[0])
+    
+    async def __aenter__(self):
+        wait = self._reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._reserve()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+class ExerciseExtractionCache:
+    """
+    On-disk cache of Gemini exercise responses, one JSON file per request
+    
+    Files live at {cache_dir}/{sha256}.json. Entries older than ttl_days
+    (None = never) or no longer holding a JSON list are evicted on read.
+    """
+    
+    def __init__(self, cache_dir=os.path.join('data', 'llm_cache'), ttl_days=None):
+        self.cache_dir = cache_dir
+        self.ttl_days = ttl_days
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(*fields):
+        """
+        SHA-256 over the fields, each prefixed with its 8-byte length
+        
+        Length-prefixing keeps ("ab", "c") and ("a", "bc") from colliding.
+        """
+        digest = hashlib.sha256()
+        for field in fields:
+            data = str(field).encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'big'))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key):
+        """
+        Return the cached exercise list for key, or None on a miss
+        
+        Args:
+            key (str): Cache key from make_key
+            
+        Returns:
+            list or None: Parsed exercises if a valid, unexpired entry exists
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = orjson.loads(f.read())
+            
+            if self.ttl_days is not None:
+                age = datetime.now() - datetime.fromisoformat(entry['created_at'])
+                if age.total_seconds() > self.ttl_days * 86400:
+                    raise ValueError("expired")
+            
+            exercises = orjson.loads(entry['response'])
+            if not isinstance(exercises, list):
+                raise ValueError("not a list")
+            return exercises
+            
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            # Expired or unusable entry - drop it so the page is re-extracted
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+    
+    def set(self, key, response_text):
+        """
+        Store a cleaned Gemini response under key
+        
+        Args:
+            key (str): Cache key from make_key
+            response_text (str): JSON text returned by Gemini
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps({"created_at": datetime.now().isoformat(), "response": response_text}))
+        # Atomic rename so concurrent runs never read a half-written entry
+        os.replace(tmp_path, path)
+
+class ExerciseStreamWriter:
+    """
+    Write the exercises JSON incrementally, one exercise per line
+    
+    Produces {"exercises": [...], "metadata": {...}}. Metadata comes last
+    because its totals are only known once extraction finishes; a crashed
+    run still leaves every exercise written so far on its own line.
+    """
+    
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.count = 0
+        self.f = open(output_file, 'wb')
+        self.f.write(b'{\n  "exercises": [')
+    
+    def write(self, exercises):
+        """
+        Append exercises to the file and flush
+        
+        Args:
+            exercises (list): Exercises to append
+        """
+        for exercise in exercises:
+            self.f.write(b',\n    ' if self.count else b'\n    ')
+            self.f.write(orjson.dumps(exercise, option=orjson.OPT_NON_STR_KEYS))
+            self.count += 1
+        self.f.flush()
+    
+    def close(self, metadata):
+        """
+        Finish the JSON document with the metadata block
+        
+        Args:
+            metadata (dict): Output metadata
+        """
+        metadata_json = orjson.dumps(metadata, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  ')
+        self.f.write(b'\n  ],\n  "metadata": ' + metadata_json + b'\n}\n')
+        self.f.close()
+
+# Extraction prompt; {pages_text} holds the PAGE-marked text of every page in the request
+_EXTRACTION_PROMPT_TEMPLATE = """
+        તમે ધોરણ 10 ગુજરાતી માધ્યમના ગણિત પાઠ્યપુસ્તકમાંથી **ફક્ત સ્વાધ્યાય/અભ્યાસ વિભાગના** પ્રશ્નો કાઢી રહ્યા છો.
+
+        **મહત્વપૂર્ણ નિયમો:**
+        1. ફક્ત "સ્વાધ્યાય X.Y" અથવા "અભ્યાસ X.Y" હેડિંગ પછીના પ્રશ્નો જ કાઢો
+        2. દરેક પ્રશ્ન માટે **ફરજિયાત** સંપૂર્ણ જવાબ અને સ્પષ્ટીકરણ આપો
+        3. Exercise number ચોક્કસ શોધીને બહાર કાઢો
+        4. **ઉપપ્રશ્ન બનાવતી વખતે મુખ્ય પ્રશ્નનો સંદર્ભ જોડો**
+
+        **ઉપપ્રશ્ન નિયમો - અતિ મહત્વપૂર્ણ:**
+        - મુખ્ય પ્રશ્ન: "નીચેના સમીકરણયુગ્મ હલ કરો:"
+        - ઉપપ્રશ્ન (i): "x + y = 5, x - y = 1" 
+        - **સંપૂર્ણ પ્રશ્ન બનાવો**: "નીચેના સમીકરણયુગ્મ હલ કરો: x + y = 5, x - y = 1"
+        - **માત્ર equations જ ન લખો** - હંમેશા મુખ્ય instruction સાથે જોડો
+
+        **Answer ફીલ્ડ:**
+        - માત્ર અંતિમ પરિણામ લખો (જેમ કે: "x = 3, y = 2")
+
+        **Explanation ફીલ્ડ:**
+        - પગલાવાર ગાણિતિક ઉકેલ એક continuous text માં લખો
+        - Mathematical equations સાચવી રાખો
+        - પગલાઓ વચ્ચે "પછી" અથવા "અને" વાપરો
+
+        **9 પ્રશ્ન પ્રકારો:**
+        1. "Very Short / Objective (O)" - 1 ગુણ
+        2. "MCQs (Multiple Choice Questions)" 
+        3. "True / False" 
+        4. "Fill in the Blanks" 
+        5. "Short Answer – I (SA-I)" - 2 ગુણ
+        6. "Short Answer – II (SA-II)" - 3 ગુણ
+        7. "Long Answer (LA)" - 4+ ગુણ
+        8. "Match the Values / (Jodka Jodo)" 
+        9. "Diagram-Based"
+
+        પાનાઓનું લખાણ (દરેક પાનું "=== PAGE n START ===" અને "=== PAGE n END ===" વચ્ચે છે):
+        {pages_text}
+
+        **ઉદાહરણ:**
+        [{{"exercise_number": "3.1", "page_number": {page_number}, "original_question_number": "1", "sub_question_number": "i", "question_text": "નીચેના સમીકરણયુગ્મ હલ કરો: x + y = 5 અને x - y = 1", "question_type": "Short Answer – II (SA-II)", "answer": "x = 3, y = 2", "explanation": "આપેલ x + y = 5 અને x - y = 1, બંને સમીકરણ ઉમેરતાં 2x = 6 તેથી x = 3, પછી x = 3 પ્રથમ સમીકરણમાં મૂકતાં 3 + y = 5 તેથી y = 2, આ ઉમેરવાની પદ્ધતિ છે.", "marks_estimate": 3, "difficulty": "Medium", "mentioned_visuals": []}}]
+
+        **ચેતવણી:**
+        - Mathematical equations જાળવી રાખો
+        - જો કોઈ સ્વાધ્યાય વિભાગ ન હોય તો માત્ર [] આપો
+        - **ઉપપ્રશ્નો માં હંમેશા મુખ્ય instruction શામેલ કરો**
+        - દરેક પ્રશ્નમાં page_number એ જ PAGE marker નો નંબર આપો જેમાં તે પ્રશ્ન છે
+        """
+
 class GSEBExerciseExtractor:
     """
     Extract exercise questions from GSEB Mathematics textbook pages.
@@ -20,8 +304,24 @@ class GSEBExerciseExtractor:
     - Generates answers and explanations
     """
     
-    def __init__(self):
-        """Initialize the exercise extractor with Gemini API setup"""
+    # Part of every cache key; changes whenever the prompt template or response schema does
+    PROMPT_VERSION = hashlib.sha256(
+        _EXTRACTION_PROMPT_TEMPLATE.encode('utf-8')
+        + orjson.dumps(ExerciseQuestion.model_json_schema(), option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()[:8]
+    
+    def __init__(self, model_name='gemini-2.5-flash-lite', fallback_model_name='gemini-2.5-flash',
+                 use_cache=True, cache_ttl_days=None):
+        """
+        Initialize the exercise extractor with Gemini API setup
+        
+        Args:
+            model_name (str): Gemini model used for extraction
+            fallback_model_name (str): Model used to re-extract pages whose response still
+                                       fails validation after the re-asks (None = no fallback)
+            use_cache (bool): Reuse earlier Gemini responses for unchanged pages
+            cache_ttl_days (float): Expire cached responses after this many days (None = never)
+        """
         # Load environment variables
         load_dotenv()
         
@@ -30,43 +330,77 @@ class GSEBExerciseExtractor:
         if not gemini_api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
             
+        # Async calls go through the SDK's shared grpc_asyncio client: one HTTP/2
+        # channel multiplexes every concurrent request, so there is one TLS
+        # handshake per run rather than one per page. The channel is bound to
+        # the event loop it was opened on, so all extraction runs on self.loop.
         genai.configure(api_key=gemini_api_key)
-        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash')
+        self.gemini_api_key = gemini_api_key
+        self.loop = asyncio.new_event_loop()
+        
+        # Structured output: Gemini answers with a JSON list of ExerciseQuestion
+        self.generation_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=list[ExerciseQuestion]
+        )
+        self.model_name = model_name
+        self.gemini_model = genai.GenerativeModel(self.model_name, generation_config=self.generation_config)
+        
+        # Pages whose response still fails validation after the re-asks are redone here
+        self.fallback_model_name = fallback_model_name
+        self.fallback_model = (
+            genai.GenerativeModel(fallback_model_name, generation_config=self.generation_config)
+            if fallback_model_name else None
+        )
+        
+        # Responses cached on disk by model, prompt version, chapter and page text
+        self.cache = ExerciseExtractionCache(ttl_days=cache_ttl_days) if use_cache else None
         
         # Track API usage for cost monitoring
         self.api_calls = {"gemini_api": 0}
         
+        # Prompts in flight at once; the work is waiting on Gemini, not CPU
+        self.max_concurrency = int(os.getenv('EXERCISE_MAX_CONCURRENCY', '5'))
+        
+        # Consecutive pages sent together in one prompt
+        self.pages_per_prompt = int(os.getenv('EXERCISE_PAGES_PER_PROMPT', '5'))
+        
+        # Requests per minute across all concurrent prompts, plus retries on 429 responses
+        self.rate_limiter = RateLimiter(max_calls=int(os.getenv('GEMINI_RPM', '60')), period=60)
+        self.max_attempts = 3
+        
+        # Responses failing schema validation are re-asked with the errors appended
+        self.max_validation_retries = 2
+        
+        # Batch API jobs are polled until they reach a final state
+        self.batch_client = None
+        self.batch_poll_seconds = 30
+        
         # Define question types for validation
-        self.valid_question_types = [
-            "Very Short / Objective (O)",
-            "MCQs (Multiple Choice Questions)",
-            "True / False",
-            "Fill in the Blanks", 
-            "Short Answer – I (SA-I)",
-            "Short Answer – II (SA-II)",
-            "Long Answer (LA)",
-            "Match the Values / (Jodka Jodo)",
-            "Diagram-Based"
-        ]
+        self.valid_question_types = list(QUESTION_TYPES)
         
         print("📚 Initialized GSEB Exercise Extractor")
         print(f"🔑 Gemini API Key: {'✅ Loaded' if gemini_api_key else '❌ Missing'}")
         print(f"🎯 Target Subject: Mathematics (All Chapters)")
 
-    def load_processed_json(self, json_file_path):
+    def load_processed_json(self, json_file_path, raw=None):
         """
         Load processed JSON from main.py output
         
         Args:
             json_file_path (str): Path to the processed chapter JSON file
+            raw (bytes): The file's contents, if the caller already read them
+                         (e.g. to hash them); otherwise the file is read here
             
         Returns:
             dict: Loaded JSON data with pages and metadata
         """
         print(f"\n📂 Loading processed JSON: {json_file_path}")
         
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if raw is None:
+            with open(json_file_path, 'rb') as f:
+                raw = f.read()
+        data = orjson.loads(raw)
         
         print(f"📊 Loaded data:")
         print(f"  📄 Total pages: {len(data.get('pages', []))}")
@@ -74,12 +408,21 @@ class GSEBExerciseExtractor:
         
         return data
 
-    def extract_exercises_from_chapter(self, json_data):
+    def extract_exercises_from_chapter(self, json_data, batch_mode=False, output_file=None,
+                                       source_sha256=None):
         """
         Main method to extract exercises from all pages of a mathematics chapter
         
         Args:
             json_data (dict): Processed chapter data with page-by-page text
+            batch_mode (bool): Submit all pages as one Gemini Batch API job
+                               (discounted, but waits for the job) instead of
+                               interactive calls
+            output_file (str): If given, exercises are streamed to this JSON
+                               file page by page as they are finished
+            source_sha256 (str): Hash of the input chapter file, recorded in
+                                 the output metadata; the file is marked
+                                 complete only if extraction finishes
             
         Returns:
             list: List of extracted exercise questions with metadata
@@ -93,46 +436,66 @@ class GSEBExerciseExtractor:
         
         all_exercises = []
         
-        # Process each page looking for exercise sections
-        for page in tqdm(pages_data, desc="🔍 Processing pages for exercises"):
-            try:
-                page_number = page.get('page_number', 0)
-                page_text = page.get('text', '')
+        # Select the pages worth sending to Gemini
+        exercise_pages = []
+        for page in pages_data:
+            page_number = page.get('page_number', 0)
+            page_text = page.get('text', '')
+            
+            # Skip pages with insufficient content
+            if len(page_text) < 100:
+                logger.debug(f"⏭️  Page {page_number}: Insufficient content, skipping")
+                continue
                 
-                # Skip pages with insufficient content
-                if len(page_text) < 100:
-                    print(f"    ⏭️  Page {page_number}: Insufficient content, skipping")
+            # Check for exercise indicators in the page
+            if not self._has_exercise_content(page_text):
+                continue
+            
+            logger.debug(f"🎯 Page {page_number}: Exercise content detected")
+            exercise_pages.append(page)
+        
+        writer = ExerciseStreamWriter(output_file) if output_file else None
+        completed = False
+        try:
+            # Step 1: Extract exercises using AI
+            if batch_mode:
+                page_results = self._extract_pages_batch(exercise_pages, chapter_name)
+            else:
+                page_results = self.loop.run_until_complete(self._extract_all(exercise_pages, chapter_name))
+            
+            # Step 2: Enhance with visual descriptions, in page order
+            for index, page in enumerate(exercise_pages):
+                exercises = page_results.get(index)
+                if not exercises:
                     continue
-                    
-                # # Check for exercise indicators in the page
-                # if not self._has_exercise_content(page_text):
-                #     continue
-                
-                print(f"    🎯 Page {page_number}: Exercise content detected")
-                
-                # Step 1: Extract exercises using AI
-                exercises = self._extract_exercises_with_ai(page_text, chapter_name, page_number)
                 
-                if exercises:
-                    # Step 2: Enhance with visual descriptions from page images
+                try:
                     exercises = self._enhance_exercises_with_visual_content(exercises, page)
                     
                     # Log extraction results
-                    for exercise in exercises:
-                        qtype = exercise.get('question_type', 'Unknown')
-                        visuals_count = len(exercise.get('mentioned_visuals', []))
-                        print(f"      📝 Q{exercise.get('original_question_number', '')}"
-                              f"({exercise.get('sub_question_number', '')}): {qtype}, "
-                              f"{visuals_count} visuals")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        for exercise in exercises:
+                            qtype = exercise.get('question_type', 'Unknown')
+                            visuals_count = len(exercise.get('mentioned_visuals', []))
+                            logger.debug(f"📝 Q{exercise.get('original_question_number', '')}"
+                                         f"({exercise.get('sub_question_number', '')}): {qtype}, "
+                                         f"{visuals_count} visuals")
                     
                     all_exercises.extend(exercises)
-                
-                # Rate limiting to avoid API overload
-                time.sleep(1)
-                
-            except Exception as e:
-                print(f"  ❌ Error processing page {page_number}: {str(e)[:100]}...")
-                continue
+                    if writer is not None:
+                        writer.write(exercises)
+                    
+                except Exception as e:
+                    logger.error(f"❌ Error processing page {page.get('page_number', 0)}: {str(e)[:100]}...")
+                    continue
+            
+            completed = True
+        finally:
+            # Always close the document so a failed run still leaves valid JSON,
+            # but only a finished run is marked complete (and skipped next time)
+            if writer is not None:
+                writer.close(self._output_metadata(writer.count, source_sha256, complete=completed))
+                print(f"\n💾 Streamed {writer.count} exercises to: {output_file}")
         
         print(f"\n📚 EXTRACTION COMPLETED")
         print(f"📝 Total questions extracted: {len(all_exercises)}")
@@ -144,6 +507,180 @@ class GSEBExerciseExtractor:
 
 
 
+    async def _extract_all(self, pages, chapter_name):
+        """
+        Extract exercises with interactive Gemini calls
+        
+        Uncached pages are grouped pages_per_prompt at a time into one prompt,
+        and up to max_concurrency prompts are in flight at once.
+        
+        Args:
+            pages (list): Page dicts to extract from
+            chapter_name (str): Name of the mathematics chapter
+            
+        Returns:
+            dict: Page index -> list of extracted exercises
+        """
+        page_results = {}
+        pending = []
+        for index, page in enumerate(pages):
+            exercises = self._get_cached_exercises(
+                page.get('text', ''), chapter_name, page.get('page_number', 0)
+            )
+            if exercises is None:
+                pending.append(index)
+            else:
+                page_results[index] = exercises
+        
+        chunks = [pending[i:i + self.pages_per_prompt]
+                  for i in range(0, len(pending), self.pages_per_prompt)]
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        progress = tqdm(total=len(chunks), desc="🔍 Processing pages for exercises")
+        
+        async def extract(chunk):
+            try:
+                async with semaphore:
+                    results = await self._extract_exercises_batch_async(
+                        [pages[index] for index in chunk], chapter_name
+                    )
+                for index, exercises in zip(chunk, results):
+                    page_results[index] = exercises
+            except Exception as e:
+                page_numbers = ", ".join(str(pages[index].get('page_number', 0)) for index in chunk)
+                logger.error(f"❌ Error processing pages {page_numbers}: {str(e)[:100]}...")
+            progress.update(1)
+        
+        try:
+            await asyncio.gather(*(extract(chunk) for chunk in chunks))
+        finally:
+            progress.close()
+        
+        return page_results
+
+    def _extract_pages_batch(self, pages, chapter_name):
+        """
+        Extract exercises for all pages with a single Gemini Batch API job
+        
+        Pages already in the cache are not resubmitted.
+        
+        Args:
+            pages (list): Page dicts to extract from
+            chapter_name (str): Name of the mathematics chapter
+            
+        Returns:
+            dict: Page index -> list of extracted exercises
+        """
+        page_results = {}
+        request_keys = {}
+        
+        for index, page in enumerate(pages):
+            if self.cache is not None:
+                exercises = self.cache.get(
+                    self._cache_key(page.get('text', ''), chapter_name, page.get('page_number', 0))
+                )
+                if exercises is not None:
+                    page_results[index] = self._validate_exercises(exercises, chapter_name)
+                    continue
+            request_keys[f"page_{page.get('page_number', 0)}"] = index
+        
+        if not request_keys:
+            return page_results
+        
+        # One google-genai client (and its HTTP connection pool) for every batch job
+        if self.batch_client is None:
+            self.batch_client = google_genai.Client(api_key=self.gemini_api_key)
+        client = self.batch_client
+        
+        # Same response_schema as the interactive path, in REST (camelCase) form
+        config_proto = genai.protos.GenerationConfig(
+            generation_types.to_generation_config_dict(self.generation_config)
+        )
+        generation_config = type(config_proto).to_dict(
+            config_proto,
+            use_integers_for_enums=False,
+            including_default_value_fields=False,
+            preserving_proto_field_name=False
+        )
+        
+        # One JSONL line per page: {"key": ..., "request": GenerateContentRequest}
+        with tempfile.NamedTemporaryFile('wb', suffix='.jsonl', delete=False) as f:
+            for key, index in request_keys.items():
+                page = pages[index]
+                prompt = self._build_extraction_prompt([page], chapter_name)
+                request = {"key": key, "request": {
+                    "contents": [{"parts": [{"text": prompt}]}],
+                    "generationConfig": generation_config
+                }}
+                f.write(orjson.dumps(request) + b"\n")
+            requests_path = f.name
+        
+        try:
+            uploaded = client.files.upload(
+                file=requests_path,
+                config=genai_types.UploadFileConfig(display_name="exercise-requests", mime_type="jsonl")
+            )
+        finally:
+            os.remove(requests_path)
+        
+        job = client.batches.create(
+            model=self.model_name,
+            src=uploaded.name,
+            config={"display_name": f"exercises-{chapter_name}"}
+        )
+        logger.info(f"📦 Submitted batch job {job.name} for {len(request_keys)} pages")
+        
+        done_states = {
+            genai_types.JobState.JOB_STATE_SUCCEEDED,
+            genai_types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+            genai_types.JobState.JOB_STATE_FAILED,
+            genai_types.JobState.JOB_STATE_CANCELLED,
+            genai_types.JobState.JOB_STATE_EXPIRED
+        }
+        while job.state not in done_states:
+            time.sleep(self.batch_poll_seconds)
+            job = client.batches.get(name=job.name)
+            logger.info(f"⏳ Batch job state: {job.state.name}")
+        
+        if job.state not in (genai_types.JobState.JOB_STATE_SUCCEEDED,
+                             genai_types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED):
+            raise RuntimeError(f"Batch job {job.name} finished with state {job.state.name}")
+        
+        self.api_calls["gemini_api"] += len(request_keys)
+        
+        results = client.files.download(file=job.dest.file_name)
+        for line in results.splitlines():
+            if not line.strip():
+                continue
+            
+            result = orjson.loads(line)
+            index = request_keys.get(result.get('key'))
+            if index is None:
+                continue
+            
+            page = pages[index]
+            page_number = page.get('page_number', 0)
+            response = result.get('response')
+            if not response:
+                logger.error(f"❌ Batch error on page {page_number}: {str(result.get('error'))[:100]}")
+                continue
+            
+            try:
+                parts = response['candidates'][0]['content']['parts']
+                exercises = self._parse_exercises("".join(part.get('text', '') for part in parts))
+            except (KeyError, IndexError, ValidationError) as e:
+                logger.error(f"❌ Could not parse batch response for page {page_number}: {str(e)[:100]}")
+                continue
+            
+            if self.cache is not None:
+                self.cache.set(
+                    self._cache_key(page.get('text', ''), chapter_name, page_number),
+                    orjson.dumps(exercises).decode('utf-8')
+                )
+            page_results[index] = self._validate_exercises(exercises, chapter_name)
+        
+        return page_results
+
     def _has_exercise_content(self, page_text):
         """
         Check if page contains actual exercise/practice sections (not just any questions)
@@ -154,23 +691,12 @@ class GSEBExerciseExtractor:
         Returns:
             bool: True if page has actual exercise section headers
         """
-        import re
-        
-        # Strict exercise section patterns with numbers
-        exercise_patterns = [
-            r'સ્વાધ્યાય\s+\d+\.\d+',      # સ્વાધ્યાય 3.1, સ્વાધ્યાય 2.5
-            r'અભ્યાસ\s+\d+\.\d+',         # અભ્યાસ 3.1
-            r'પ્રેક્ટિસ\s+\d+\.\d+',       # પ્રેક્ટિસ 3.1
-            r'Exercise\s+\d+\.\d+',        # Exercise 3.1
-            r'કસોટી\s+\d+\.\d+'           # કસોટી 3.1
-        ]
-        
         # Check for specific exercise section headers
-        for pattern in exercise_patterns:
-            match = re.search(pattern, page_text)
+        for pattern in _EXERCISE_PATTERNS:
+            match = pattern.search(page_text)
             if match:
                 found_section = match.group()
-                print(f"    ✅ Found exercise section: {found_section}")
+                logger.debug(f"✅ Found exercise section: {found_section}")
                 return True
         
         # Secondary check for exercise indicators without numbers (less strict)
@@ -180,10 +706,10 @@ class GSEBExerciseExtractor:
             if indicator in page_text:
                 # Additional validation: check if followed by numbered questions
                 if self._has_numbered_questions_after_indicator(page_text, indicator):
-                    print(f"    ✅ Found exercise content with {indicator}")
+                    logger.debug(f"✅ Found exercise content with {indicator}")
                     return True
         
-        print(f"    ⏭️  No exercise section found on this page")
+        logger.debug(f"⏭️  No exercise section found on this page")
         return False
 
     def _has_numbered_questions_after_indicator(self, page_text, indicator):
@@ -197,36 +723,17 @@ class GSEBExerciseExtractor:
         Returns:
             bool: True if numbered questions found after indicator
         """
-        import re
-        
         # Find the position of the indicator
         indicator_pos = page_text.find(indicator)
         if indicator_pos == -1:
             return False
         
-        # Look for numbered questions after the indicator
-        text_after_indicator = page_text[indicator_pos:]
-        
-        # Patterns for numbered questions
-        question_patterns = [
-            r'\n\s*\d+\.\s+',          # 1. 2. 3.
-            r'\n\s*\(\s*[ivx]+\s*\)',  # (i) (ii) (iii)
-            r'\n\s*[અઆઇ]\)\s+'        # અ) આ) ઇ)
-        ]
-        
-        for pattern in question_patterns:
-            if re.search(pattern, text_after_indicator[:500]):  # Check next 500 chars
-                return True
-        
-        return False
-
-
-
-
+        # Look for numbered questions in the next 500 chars, without slicing
+        return _QUESTIONS_AFTER.search(page_text, indicator_pos, indicator_pos + 500) is not None
 
-    def _extract_exercises_with_ai(self, page_text, chapter_name, page_number):
+    def _get_cached_exercises(self, page_text, chapter_name, page_number):
         """
-        Use Gemini AI to extract and classify exercise questions from page text
+        Look up a page's exercises in the response cache
         
         Args:
             page_text (str): Text content of the page
@@ -234,126 +741,233 @@ class GSEBExerciseExtractor:
             page_number (int): Page number for reference
             
         Returns:
-            list: List of extracted exercise questions with full metadata
+            list or None: Validated exercises on a hit, None on a miss
         """
-        print(f"    🤖 Using AI to extract exercises from page {page_number}")
+        if self.cache is None:
+            return None
         
+        exercises = self.cache.get(self._cache_key(page_text, chapter_name, page_number))
+        if exercises is None:
+            return None
+        
+        logger.debug(f"💾 Using cached response for page {page_number}")
+        return self._validate_exercises(exercises, chapter_name)
 
-        prompt = f"""
-        તમે ધોરણ 10 ગુજરાતી માધ્યમના ગણિત પાઠ્યપુસ્તકમાંથી **ફક્ત સ્વાધ્યાય/અભ્યાસ વિભાગના** પ્રશ્નો કાઢી રહ્યા છો.
-
-        **JSON આઉટપુટ ફરજિયાત નિયમો:**
-        - તમારો જવાબ માત્ર JSON format માં હોવો જોઈએ
-        - Explanation field માં line breaks (\\n) ન વાપરો
-        - Mathematical equations અને symbols વાપરી શકો છો (x=3, y=2, +, -, =, etc.)
-        - ફક્ત new lines અને tabs ટાળો
-
-        **મહત્વપૂર્ણ નિયમો:**
-        1. ફક્ત "સ્વાધ્યાય X.Y" અથવા "અભ્યાસ X.Y" હેડિંગ પછીના પ્રશ્નો જ કાઢો
-        2. દરેક પ્રશ્ન માટે **ફરજિયાત** સંપૂર્ણ જવાબ અને સ્પષ્ટીકરણ આપો
-        3. Exercise number ચોક્કસ શોધીને બહાર કાઢો
-        4. **ઉપપ્રશ્ન બનાવતી વખતે મુખ્ય પ્રશ્નનો સંદર્ભ જોડો**
-
-        **ઉપપ્રશ્ન નિયમો - અતિ મહત્વપૂર્ણ:**
-        - મુખ્ય પ્રશ્ન: "નીચેના સમીકરણયુગ્મ હલ કરો:"
-        - ઉપપ્રશ્ન (i): "x + y = 5, x - y = 1" 
-        - **સંપૂર્ણ પ્રશ્ન બનાવો**: "નીચેના સમીકરણયુગ્મ હલ કરો: x + y = 5, x - y = 1"
-        - **માત્ર equations જ ન લખો** - હંમેશા મુખ્ય instruction સાથે જોડો
-
-        **Answer ફીલ્ડ:**
-        - માત્ર અંતિમ પરિણામ લખો (જેમ કે: "x = 3, y = 2")
-
-        **Explanation ફીલ્ડ:**
-        - પગલાવાર ગાણિતિક ઉકેલ એક continuous text માં લખો
-        - Mathematical equations સાચવી રાખો
-        - પગલાઓ વચ્ચે "પછી" અથવા "અને" વાપરો
-
-        **9 પ્રશ્ન પ્રકારો:**
-        1. "Very Short / Objective (O)" - 1 ગુણ
-        2. "MCQs (Multiple Choice Questions)" 
-        3. "True / False" 
-        4. "Fill in the Blanks" 
-        5. "Short Answer – I (SA-I)" - 2 ગુણ
-        6. "Short Answer – II (SA-II)" - 3 ગુણ
-        7. "Long Answer (LA)" - 4+ ગુણ
-        8. "Match the Values / (Jodka Jodo)" 
-        9. "Diagram-Based"
-
-        પાનાનું લખાણ:
-        {page_text}
-
-        **ફક્ત નીચેના JSON ફોર્મેટ માં આપો:**
-        [{{"exercise_number": "3.1", "page_number": {page_number}, "original_question_number": "1", "sub_question_number": "i", "question_text": "નીચેના સમીકરણયુગ્મ હલ કરો: x + y = 5 અને x - y = 1", "question_type": "Short Answer – II (SA-II)", "answer": "x = 3, y = 2", "explanation": "આપેલ x + y = 5 અને x - y = 1, બંને સમીકરણ ઉમેરતાં 2x = 6 તેથી x = 3, પછી x = 3 પ્રથમ સમીકરણમાં મૂકતાં 3 + y = 5 તેથી y = 2, આ ઉમેરવાની પદ્ધતિ છે.", "marks_estimate": 3, "difficulty": "Medium", "mentioned_visuals": []}}]
-
-        **ચેતવણી:**
-        - Mathematical equations જાળવી રાખો
-        - ફક્ત line breaks ટાળો, equations નહીં
-        - જો કોઈ સ્વાધ્યાય વિભાગ ન હોય તો માત્ર [] આપો
-        - **ઉપપ્રશ્નો માં હંમેશા મુખ્ય instruction શામેલ કરો**
+    async def _extract_exercises_batch_async(self, pages_chunk, chapter_name):
         """
-
-
-
-        try:
-            response = self.gemini_model.generate_content(prompt)
-            self.api_calls["gemini_api"] += 1
-            
-            response_text = response.text.strip()
+        Extract exercises from several pages with a single Gemini call
+        
+        Args:
+            pages_chunk (list): Page dicts to send together
+            chapter_name (str): Name of the mathematics chapter
             
-            if not response_text:
-                return []
+        Returns:
+            list: One list of extracted exercises per page, in pages_chunk order
+        """
+        page_results = await self._request_exercises_async(pages_chunk, chapter_name, self.gemini_model)
+        
+        results = []
+        for page, exercises in zip(pages_chunk, page_results):
+            page_number = page.get('page_number', 0)
             
-            # Clean markdown formatting if present
-            response_text = self._clean_response_text(response_text)
+            # Failed requests are not cached, so they are retried next run
+            if exercises is None:
+                results.append([])
+                continue
             
-        # Parse JSON response
-            exercises = json.loads(response_text)
+            # Cached per page, so later runs hit regardless of how pages were grouped
+            if self.cache is not None:
+                self.cache.set(
+                    self._cache_key(page.get('text', ''), chapter_name, page_number),
+                    orjson.dumps(exercises).decode('utf-8')
+                )
+            results.append(self._validate_exercises(exercises, chapter_name))
+        
+        return results
+
+    async def _request_exercises_async(self, pages_chunk, chapter_name, model):
+        """
+        Send one prompt for pages_chunk and split the answer back into pages
+        
+        A response that fails ExerciseQuestion validation is re-asked up to
+        max_validation_retries times with the errors appended to the prompt.
+        If it still fails (or the JSON was cut off), the chunk is split in half
+        and each half retried, so one bad page doesn't lose the others. A single
+        page that still fails is re-extracted on the fallback model.
+        
+        In a multi-page reply, a page with no tagged exercises can't be told apart
+        from a page the model skipped, so it is re-asked alone; only a single-page
+        reply is trusted to mean "no exercises".
+        
+        Args:
+            pages_chunk (list): Page dicts to send together
+            chapter_name (str): Name of the mathematics chapter
+            model (GenerativeModel): Gemini model to call
             
-            if not isinstance(exercises, list):
-                return []
-            
-            # Filter and validate exercises before adding metadata
-            validated_exercises = []
-            for exercise in exercises:
-                if isinstance(exercise, dict):
-                    exercise["chapter"] = chapter_name
-                    exercise["extracted_at"] = datetime.now().isoformat()
-                    exercise["source"] = "exercise"
-                    exercise["status"] = "inactive"
-                    validated_exercises.append(exercise)
-                else:
-                    print(f"      ⚠️  Skipping invalid exercise type: {type(exercise)}")
+        Returns:
+            list: Per page, the raw exercise list, or None if the request failed
+        """
+        page_numbers = [page.get('page_number', 0) for page in pages_chunk]
+        logger.debug(f"🤖 Using AI to extract exercises from pages {', '.join(map(str, page_numbers))}")
+        
+        prompt = self._build_extraction_prompt(pages_chunk, chapter_name)
+        
+        try:
+            for attempt in range(self.max_validation_retries + 1):
+                response = await self._generate_with_retry_async(prompt, model)
+                try:
+                    exercises = self._parse_exercises(response.text)
+                    break
+                except ValidationError as e:
+                    # Truncated JSON won't fix itself on a re-ask; split the chunk instead
+                    truncated = any(error['type'] == 'json_invalid' for error in e.errors())
+                    if attempt == self.max_validation_retries or (truncated and len(pages_chunk) > 1):
+                        raise
+                    logger.warning(f"⚠️  Response failed validation, re-asking ({e.error_count()} errors)")
+                    prompt = self._build_extraction_prompt(pages_chunk, chapter_name) + (
+                        "\n        તમારા પાછલા જવાબમાં નીચેની ભૂલો હતી, સુધારીને ફરી આપો:\n"
+                        f"        {str(e)[:2000]}\n"
+                    )
             
-            print(f"      ✅ Successfully extracted {len(validated_exercises)} exercises")
-            return validated_exercises
+        except ValidationError as e:
+            if len(pages_chunk) > 1:
+                logger.warning(f"⚠️  Invalid response, retrying pages in smaller groups")
+                middle = len(pages_chunk) // 2
+                return (await self._request_exercises_async(pages_chunk[:middle], chapter_name, model)
+                        + await self._request_exercises_async(pages_chunk[middle:], chapter_name, model))
+            if self.fallback_model is not None and model is not self.fallback_model:
+                logger.warning(f"🔁 Page {page_numbers[0]}: response still invalid, retrying on {self.fallback_model_name}")
+                return await self._request_exercises_async(pages_chunk, chapter_name, self.fallback_model)
+            logger.error(f"❌ Invalid response: {str(e)[:200]}")
+            return [None]
+        except Exception as e:
+            logger.error(f"❌ AI extraction error: {str(e)}")
+            return [None for _ in pages_chunk]
+        
+        # Split the flat list back into pages using the page_number Gemini tagged
+        if len(pages_chunk) == 1:
+            return [exercises]
+        
+        page_exercises = {str(page_number): [] for page_number in page_numbers}
+        for exercise in exercises:
+            page_key = str(exercise['page_number'])
+            if page_key in page_exercises:
+                page_exercises[page_key].append(exercise)
+            else:
+                logger.warning(f"⚠️  Skipping exercise with an unknown page_number: {str(exercise)[:50]}")
+        
+        results = [page_exercises[str(page_number)] for page_number in page_numbers]
+        absent = [index for index, page_result in enumerate(results) if not page_result]
+        if absent:
+            logger.debug(f"🔁 Pages {', '.join(str(page_numbers[i]) for i in absent)} absent from the reply, asking alone")
+            retried = await asyncio.gather(
+                *(self._request_exercises_async([pages_chunk[i]], chapter_name, model) for i in absent)
+            )
+            for index, (page_result,) in zip(absent, retried):
+                results[index] = page_result
+        
+        return results
 
+    def _build_extraction_prompt(self, pages, chapter_name):
+        """
+        Build the Gemini prompt for extracting exercises from one or more pages
+        
+        Args:
+            pages (list): Page dicts; each page's text is wrapped in PAGE markers
+            chapter_name (str): Name of the mathematics chapter
             
-        except json.JSONDecodeError as e:
-            print(f"      ❌ JSON parsing error: {str(e)}")
-            return []
-        except Exception as e:
-            print(f"      ❌ AI extraction error: {str(e)}")
-            return []
+        Returns:
+            str: Prompt text
+        """
+        pages_text = "\n".join(
+            f"=== PAGE {page.get('page_number', 0)} START ===\n"
+            f"{page.get('text', '')}\n"
+            f"=== PAGE {page.get('page_number', 0)} END ==="
+            for page in pages
+        )
+        return _EXTRACTION_PROMPT_TEMPLATE.format(
+            pages_text=pages_text, page_number=pages[0].get('page_number', 0)
+        )
 
+    def _cache_key(self, page_text, chapter_name, page_number):
+        """Cache key for one page's extraction request"""
+        return ExerciseExtractionCache.make_key(
+            self.model_name, self.PROMPT_VERSION, page_text, chapter_name, page_number
+        )
 
-    def _clean_response_text(self, response_text):
+    def _parse_exercises(self, response_text):
         """
-        Clean markdown formatting from Gemini response
+        Validate a Gemini response against the ExerciseQuestion schema
         
         Args:
-            response_text (str): Raw response from Gemini
+            response_text (str): Raw response text (JSON, via response_schema)
+            
+        Returns:
+            list: Exercise dicts
+            
+        Raises:
+            ValidationError: If the response is not valid JSON or doesn't match the schema
+        """
+        return [exercise.model_dump() for exercise in _EXERCISE_LIST.validate_json(response_text)]
+
+    def _validate_exercises(self, exercises, chapter_name):
+        """
+        Filter and validate exercises before adding metadata
+        
+        Args:
+            exercises (list): Parsed exercises from Gemini
+            chapter_name (str): Name of the mathematics chapter
             
         Returns:
-            str: Cleaned JSON text
+            list: Exercise dicts with chapter/source/status metadata
         """
-        # Remove markdown code blocks
-        if response_text.startswith("```"):
-            response_text = response_text.strip("`")
-            if response_text.lower().startswith("json"):
-                response_text = response_text[4:].strip()
+        # One UTC timestamp per page rather than one per exercise
+        extracted_at = datetime.now(tz=timezone.utc).isoformat()
         
-        return response_text.strip()
+        validated_exercises = []
+        for exercise in exercises:
+            if isinstance(exercise, dict):
+                exercise["chapter"] = chapter_name
+                exercise["extracted_at"] = extracted_at
+                exercise["source"] = "exercise"
+                exercise["status"] = "inactive"
+                validated_exercises.append(exercise)
+            else:
+                logger.warning(f"⚠️  Skipping invalid exercise type: {type(exercise)}")
+        
+        logger.debug(f"✅ Successfully extracted {len(validated_exercises)} exercises")
+        return validated_exercises
 
+    async def _generate_with_retry_async(self, prompt, model=None):
+        """
+        Call Gemini through the shared rate limiter, backing off on 429 responses
+        
+        Args:
+            prompt (str): Prompt to send
+            model (GenerativeModel): Model to call (defaults to the primary model)
+            
+        Returns:
+            Gemini response object
+        """
+        if model is None:
+            model = self.gemini_model
+        
+        for attempt in range(self.max_attempts):
+            try:
+                async with self.rate_limiter:
+                    response = await model.generate_content_async(prompt)
+                
+                self.api_calls["gemini_api"] += 1
+                return response
+                
+            except ResourceExhausted:
+                if attempt == self.max_attempts - 1:
+                    raise
+                
+                # Exponential backoff with jitter so requests don't retry in lockstep
+                delay = 2 ** attempt + random.uniform(0, 1)
+                logger.warning(f"⏳ Gemini rate limit hit, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
 
     def _enhance_exercises_with_visual_content(self, exercises, page_data):
         """
@@ -370,14 +984,15 @@ class GSEBExerciseExtractor:
         if not page_images:
             return exercises
         
-        print(f"      🖼️  Enhancing {len(exercises)} exercises with visual content")
+        logger.debug(f"🖼️  Enhancing {len(exercises)} exercises with visual content")
         
+        visual_index = self._build_visual_index(page_images)
         enhanced_exercises = []
         
         for exercise in exercises:
             # Add type checking to handle both dict and string cases
             if not isinstance(exercise, dict):
-                print(f"        ⚠️  Skipping invalid exercise type: {type(exercise)}")
+                logger.warning(f"⚠️  Skipping invalid exercise type: {type(exercise)}")
                 continue
             
             mentioned_visuals = exercise.get('mentioned_visuals', [])
@@ -397,15 +1012,15 @@ class GSEBExerciseExtractor:
                 
                 # Find matching description from page images
                 matching_desc = self._find_matching_visual_description(
-                    visual_ref, visual_type, page_images
+                    visual_ref, visual_type, visual_index
                 )
                 
                 if matching_desc:
                     visual['full_description'] = matching_desc
-                    print(f"        ✅ Found description for {visual_ref}")
+                    logger.debug(f"✅ Found description for {visual_ref}")
                 else:
                     visual['full_description'] = "વર્ણન ઉપલબ્ધ નથી"
-                    print(f"        ⚠️  No description found for {visual_ref}")
+                    logger.debug(f"⚠️  No description found for {visual_ref}")
             
             enhanced_exercises.append(exercise)
         
@@ -414,50 +1029,58 @@ class GSEBExerciseExtractor:
 
 
 
-    def _find_matching_visual_description(self, visual_reference, visual_type, page_images):
+    def _build_visual_index(self, page_images):
+        """
+        Index a page's image descriptions once so each visual lookup is a dict access
+        
+        Args:
+            page_images (list): List of detected images on the page
+            
+        Returns:
+            tuple: ({ref number: [descriptions containing it]},
+                    {visual type: first description matching its keywords})
+        """
+        num_index = {}
+        type_index = {}
+        
+        for image in page_images:
+            img_desc = image.get('educational_description', '')
+            for ref_number in set(_REF_NUM.findall(img_desc)):
+                num_index.setdefault(ref_number, []).append(img_desc)
+            
+            img_desc_lower = img_desc.lower()
+            for visual_type, keywords in _VISUAL_TYPE_KEYWORDS.items():
+                if visual_type not in type_index and any(keyword in img_desc_lower for keyword in keywords):
+                    type_index[visual_type] = img_desc
+        
+        return num_index, type_index
+
+    def _find_matching_visual_description(self, visual_reference, visual_type, visual_index):
         """
         Find matching image description based on reference and type
         
         Args:
             visual_reference (str): Reference like "આકૃતિ 3.5"
             visual_type (str): Type like "આકૃતિ", "આલેખ"
-            page_images (list): List of detected images on the page
+            visual_index (tuple): Lookup tables from _build_visual_index
             
         Returns:
             str or None: Matching description if found
         """
-        import re
+        num_index, type_index = visual_index
         
         # Method 1: Exact reference matching
         if visual_reference:
-            ref_match = re.search(r'\d+\.\d+', visual_reference)
+            ref_match = _REF_NUM.search(visual_reference)
             if ref_match:
-                ref_number = ref_match.group()
                 ref_type = visual_reference.split()[0]  # આકૃતિ, આલેખ
                 
-                for image in page_images:
-                    img_desc = image.get('educational_description', '')
-                    if ref_number in img_desc and ref_type in img_desc:
+                for img_desc in num_index.get(ref_match.group(), ()):
+                    if ref_type in img_desc:
                         return img_desc
         
         # Method 2: Type-based matching
-        visual_type_lower = visual_type.lower()
-        
-        type_keywords = {
-            'આકૃતિ': ['આકૃતિ', 'figure', 'diagram'],
-            'આલેખ': ['આલેખ', 'graph', 'chart'],
-            'કોષ્ટક': ['કોષ્ટક', 'table']
-        }
-        
-        if visual_type_lower in type_keywords:
-            keywords = type_keywords[visual_type_lower]
-            
-            for image in page_images:
-                img_desc = image.get('educational_description', '').lower()
-                if any(keyword in img_desc for keyword in keywords):
-                    return image.get('educational_description', '')
-        
-        return None
+        return type_index.get(visual_type.lower())
 
     def _get_chapter_name(self, json_data):
         """
@@ -531,24 +1154,42 @@ class GSEBExerciseExtractor:
         
         # Create output data structure
         output_data = {
-            "metadata": {
-                "extraction_type": "exercises",
-                "subject": "Mathematics",
-                "total_questions": len(exercises),
-                "extracted_at": datetime.now().isoformat(),
-                "api_calls": self.api_calls["gemini_api"],
-                "extractor_version": "1.0"
-            },
+            "metadata": self._output_metadata(len(exercises)),
             "exercises": exercises
         }
         
         # Write to file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         print(f"✅ EXERCISES SAVED SUCCESSFULLY")
         self._print_save_summary(exercises)
 
+    def _output_metadata(self, total_questions, source_sha256=None, complete=True):
+        """
+        Build the metadata block for an exercises output file
+        
+        Args:
+            total_questions (int): Number of exercises in the file
+            source_sha256 (str): Hash of the input chapter file, if known
+            complete (bool): Whether extraction finished (False for an interrupted run)
+            
+        Returns:
+            dict: Output metadata
+        """
+        metadata = {
+            "extraction_type": "exercises",
+            "subject": "Mathematics",
+            "total_questions": total_questions,
+            "extracted_at": datetime.now(tz=timezone.utc).isoformat(),
+            "api_calls": self.api_calls["gemini_api"],
+            "extractor_version": "1.0",
+            "complete": complete
+        }
+        if source_sha256:
+            metadata["source_sha256"] = source_sha256
+        return metadata
+
     def _print_save_summary(self, exercises):
         """
         Print summary of saved exercises
@@ -571,6 +1212,37 @@ class GSEBExerciseExtractor:
         print(f"  📄 Pages Processed: {len(unique_pages)}")
         print(f"  💰 Total API Cost: ~${self.api_calls['gemini_api'] * 0.01:.2f}")
 
+class _TqdmLoggingHandler(logging.Handler):
+    """Write log records above the progress bar instead of through it"""
+    
+    def emit(self, record):
+        try:
+            tqdm.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+def configure_logging(verbose=False):
+    """
+    Send this module's log records through a queue to a single writer thread
+    
+    Concurrent extraction only enqueues records; the QueueListener thread does
+    the terminal writes, so workers never block on stdout.
+    
+    Args:
+        verbose (bool): Show per-page and per-question DEBUG output
+    """
+    handler = _TqdmLoggingHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logger.propagate = False
+
 def main():
     """Main execution function for the exercise extractor"""
     print("📚 GSEB Mathematics Exercise Extractor")
@@ -578,9 +1250,24 @@ def main():
     print("🎯 Supports all mathematics chapters and topics")
     print("="*60)
     
+    parser = argparse.ArgumentParser(description="Extract exercises from processed chapter JSON")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always call Gemini instead of reusing cached responses")
+    parser.add_argument('--batch', action='store_true',
+                        help="Submit all pages as one Gemini Batch API job (cheaper, slower)")
+    parser.add_argument('--cache-ttl-days', type=float, default=None,
+                        help="Ignore cached responses older than this many days")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Print per-page and per-question progress")
+    parser.add_argument('--force', action='store_true',
+                        help="Re-extract even if this chapter file was already extracted")
+    args = parser.parse_args()
+    configure_logging(verbose=args.verbose)
+    
     # Initialize extractor
     try:
-        extractor = GSEBExerciseExtractor()
+        extractor = GSEBExerciseExtractor(use_cache=not args.no_cache,
+                                          cache_ttl_days=args.cache_ttl_days)
     except ValueError as e:
         print(f"❌ Initialization Error: {str(e)}")
         return
@@ -596,17 +1283,44 @@ def main():
     # Load and process the chapter data
     try:
         print("\n🔄 Loading chapter data...")
-        json_data = extractor.load_processed_json(json_file)
+        
+        # The chapter file is read once, then hashed and parsed from the same bytes.
+        # Output filename comes from the input's content hash, so rerunning an
+        # unchanged chapter finds its earlier output; exercises are streamed into it
+        with open(json_file, 'rb') as f:
+            chapter_bytes = f.read()
+        source_sha256 = hashlib.sha256(chapter_bytes).hexdigest()
+        json_data = extractor.load_processed_json(json_file, chapter_bytes)
+        chapter_slug = os.path.splitext(os.path.basename(json_file))[0]
+        output_file = f"extracted_exercises_{chapter_slug}_{source_sha256[:16]}.json"
+        
+        if not args.force and os.path.exists(output_file):
+            try:
+                with open(output_file, 'rb') as f:
+                    previous_metadata = orjson.loads(f.read())["metadata"]
+                # A run that was interrupted or raised is not marked complete
+                already_extracted = (previous_metadata.get("complete") is True
+                                     and previous_metadata.get("source_sha256") == source_sha256)
+            except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+                # Unreadable or foreign file
+                already_extracted = False
+            
+            if already_extracted:
+                print(f"\n⏭️  Chapter already extracted: {output_file} (use --force to re-extract)")
+                return
         
         print("🔄 Starting exercise extraction...")
-        exercises = extractor.extract_exercises_from_chapter(json_data)    
+        exercises = extractor.extract_exercises_from_chapter(
+            json_data, batch_mode=args.batch, output_file=output_file,
+            source_sha256=source_sha256
+        )
         
         if exercises:
-            # Generate output filename with timestamp
-            output_file = f"extracted_exercises_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            extractor.save_exercises(exercises, output_file)
+            print(f"✅ EXERCISES SAVED SUCCESSFULLY")
+            extractor._print_save_summary(exercises)
             print(f"\n🎉 SUCCESS! Exercises saved to: {output_file}")
         else:
+            os.remove(output_file)
             print("\n⚠️  No exercises found in the document")
             print("💡 Make sure the document contains સ્વાધ્યાય/અભ્યાસ sections")
             
@@ -1,20 +1,258 @@
 import os
-import json
+import sys
+import re
 import time
-import requests
+import asyncio
+import logging
+import tempfile
+import hashlib
+import threading
+import weakref
+import httpx
+import orjson
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 import google.generativeai as genai
+from google.api_core import retry as retries
+from google.api_core.exceptions import GoogleAPIError, ResourceExhausted, ServiceUnavailable
+from google.cloud import vision
+from tenacity import AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 from dotenv import load_dotenv
 from tqdm import tqdm
 from pypdf import PdfReader, PdfWriter  # For PDF page count
-from pdf2image import convert_from_path  # For converting PDF to images
-from io import BytesIO
+from pdf2image import convert_from_path, pdfinfo_from_path  # For converting PDF to images
 
 # Load environment variables
 load_dotenv()
 
+# Per-page progress goes to this logger at DEBUG (main() sets the level from GSEB_LOG);
+# step headers and summaries stay on plain print
+logger = logging.getLogger(__name__)
+
+# English keywords (from Vision API object detection)
+ENGLISH_MATHEMATICAL_KEYWORDS = [
+    'diagram', 'chart', 'graph', 'table', 'mathematical expression', 
+    'formula', 'image', 'figure', 'equation', 'plot', 'grid',
+    'coordinate', 'axis', 'line', 'curve', 'geometric', 'triangle',
+    'circle', 'rectangle', 'polygon', 'shape', 'drawing', 'illustration'
+]
+
+# Gujarati keywords (if Vision API occasionally returns Gujarati labels)
+GUJARATI_MATHEMATICAL_KEYWORDS = [
+    'આકૃતિ', 'ચાર્ટ', 'આલેખ', 'કોષ્ટક', 'સૂત્ર', 'સમીકરણ',
+    'ત્રિકોણ', 'વર્તુળ', 'ચતુર્ભુજ', 'રેખાકૃતિ', 'ચિત્ર'
+]
+
+# All keywords as one compiled alternation (Gujarati has no case, so one
+# search over the lowercased label covers both lists)
+_MATHEMATICAL_KEYWORDS_RE = re.compile(
+    "|".join(re.escape(keyword) for keyword in ENGLISH_MATHEMATICAL_KEYWORDS + GUJARATI_MATHEMATICAL_KEYWORDS)
+)
+
+@lru_cache(maxsize=4096)
+def _is_mathematical_label(object_name):
+    """Vision object labels repeat across pages ("Diagram", "Line"), so results are memoized"""
+    return _MATHEMATICAL_KEYWORDS_RE.search(object_name.lower()) is not None
+
+# Diagrams typically found in each chapter, used as hints for math-content detection
+CHAPTER_CONTENT_MAP = {
+    "વાસ્તવિક સંખ્યાઓ": [
+        "સંખ્યા રેખા પર દર્શાવેલી સંખ્યાઓ",
+        "મૂળાંક સાથે સંબંધિત આકૃતિઓ"
+    ],
+    "બહુપદીઓ": [
+        "બહુપદીઓના ગ્રાફ",
+        "મૂળ અને ગુણાકાર દર્શાવતી આકૃતિઓ"
+    ],
+    "દ્વિચલ સુરેખ સમીકરણયુગ્મ": [
+        "સમીકરણના ગ્રાફ",
+        "કોષ્ટક",
+        "રેખાઓના intersection"
+    ],
+    "દ્વિઘાત સમીકરણ": [
+        "પેરાબોલાનો ગ્રાફ",
+        "વિભિન્ન કેસ માટેના ગ્રાફ (વાસ્તવિક મૂળ, કલ્પિત મૂળ)",
+        "વર્ટેક્સ દર્શાવતો ગ્રાફ"
+    ],
+    "સમાન્તર શ્રેણી": [
+        "અનુક્રમ દર્શાવતી કોષ્ટક",
+        "આનુક્રમિક સંખ્યાઓ દર્શાવતો આલેખ"
+    ],
+    "ત્રિકોણ": [
+        "ત્રિકોણની રચના",
+        "સમાનતા દર્શાવતી આકૃતિઓ",
+        "પ્રમાણ દર્શાવતી આકૃતિઓ"
+    ],
+    "યામ ભૂમિતિ": [
+        "અક્ષાંકો પરના બિંદુઓ",
+        "અંતર સૂત્ર",
+        "વિભાગ સૂત્ર",
+        "ત્રિકોણનું ક્ષેત્રફળ દર્શાવતી આકૃતિ"
+    ],
+    "ત્રિકોણમિતિ નો પરિચય": [
+        "સમકોણ ત્રિકોણમાં ત્રિકોણમિતીય ગુણોત્તર",
+        "યૂનિટ સર્કલ"
+    ],
+    "ત્રિકોણમિતિ ના ઉપયોગો": [
+        "ઊંચાઈ અને અંતર દર્શાવતી આકૃતિઓ",
+        "કોણ ઉન્નતિ અને અવનીતિ"
+    ],
+    "વર્તુળ": [
+        "વર્તુળ",
+        "સ્પર્શક",
+        "જ્યોતિ",
+        "ત્રજ્યા"
+    ],
+    "રચના": [
+        "કંપાસથી રચના",
+        "કોણ દ્વિભાજક",
+        "ત્રિકોણની રચના"
+    ],
+    "વર્તુળ સંબંધિત ક્ષેત્રફળ": [
+        "વર્તુળનો ક્ષેત્રફળ",
+        "સેક્ટર",
+        "સેગમેન્ટ"
+    ],
+    "પૃષ્ઠફળ અને ઘનફળ": [
+        "ઘનાકૃતિઓના આલેખ",
+        "સિલિન્ડર",
+        "શંકુ",
+        "ગોળાકાર"
+    ],
+    "આંકડાશાસ્ત્ર": [
+        "હિસ્ટોગ્રામ",
+        "બાર ચાર્ટ",
+        "આવર્તન કોષ્ટક",
+        "પાઈ ચાર્ટ"
+    ],
+    "સંભાવના": [
+        "સંભાવના વૃક્ષ",
+        "પ્રયોગોના આકૃતિઓ",
+        "નમૂના સ્થાન"
+    ]
+}
+
+@lru_cache(maxsize=None)
+def _chapter_content_re(chapter_name):
+    """
+    The mathematical keywords plus the (4+ letter) words of the chapter's diagram
+    hints, as one alternation for cheaply checking whether page text can have diagrams
+    """
+    hint_words = {
+        word for hint in CHAPTER_CONTENT_MAP.get(chapter_name, ()) for word in hint.split() if len(word) >= 4
+    }
+    keywords = ENGLISH_MATHEMATICAL_KEYWORDS + GUJARATI_MATHEMATICAL_KEYWORDS + sorted(hint_words)
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+# A numbered ("1.", "2)") or bulleted ("-", "•") line in the chapter analysis,
+# capturing topic text longer than five characters
+_TOPIC_LINE_RE = re.compile(r"^[ \t]*(?:\d+[.)]?|[-•])[ \t]*(.{6,}?)[ \t]*$", re.M)
+
+class RateLimiter:
+    """
+    Sliding-window rate limiter shared by concurrent requests on one event loop.
+    Allows at most max_calls per period seconds (half that while slowed down
+    after a 429); `async with` waits until a slot is free.
+    """
+    
+    def __init__(self, max_calls, period=60):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = deque()
+        self.slow_until = 0
+    
+    def slow_down(self, duration=30):
+        """Halve the allowed rate for the next duration seconds"""
+        self.slow_until = time.monotonic() + duration
+    
+    def _reserve(self):
+        """Take a slot if one is free; otherwise return the seconds until one frees up"""
+        now = time.monotonic()
+        while self.calls and now - self.calls[0] >= self.period:
+            self.calls.popleft()
+        
+        max_calls = max(1, self.max_calls // 2) if now < self.slow_until else self.max_calls
+        if len(self.calls) < max_calls:
+            self.calls.append(now)
+            return 0
+        
+        return self.period - (now - self.calls[-max_calls])
+    
+    async def __aenter__(self):
+        wait = self._reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._reserve()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+class GeminiResponseCache:
+    """
+    On-disk cache of Gemini response texts, one JSON file per prompt, so
+    re-running a PDF (or resuming after a crash) does not re-bill tokens.
+    Entries older than ttl_days (None = never) are evicted on read.
+    """
+    
+    def __init__(self, cache_dir=os.path.join('data', 'gemini_cache'), ttl_days=7):
+        self.cache_dir = cache_dir
+        self.ttl_days = ttl_days
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(*fields):
+        """SHA-256 over the length-prefixed fields (so ("ab", "c") != ("a", "bc"))"""
+        digest = hashlib.sha256()
+        for field in fields:
+            data = str(field).encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'big'))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key):
+        """Return the cached response text for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = orjson.loads(f.read())
+            
+            if self.ttl_days is not None:
+                age = datetime.now() - datetime.fromisoformat(entry['created_at'])
+                if age.total_seconds() > self.ttl_days * 86400:
+                    raise ValueError("expired")
+            return entry['response']
+            
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            # Expired or unreadable entry - drop it so the prompt is re-sent
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+    
+    def set(self, key, response_text):
+        """Store a response text under key"""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps({"created_at": datetime.now().isoformat(), "response": response_text}))
+        # Atomic rename so concurrent runs never read a half-written entry
+        os.replace(tmp_path, path)
+
 class GSEBPDFProcessor:
+    # Part of every response-cache key; bump to invalidate cached Gemini responses
+    # when their handling changes without the prompts changing
+    RESPONSE_CACHE_VERSION = 1
+    
     def __init__(self):
         # Initialize Google Cloud Vision API key
         self.vision_api_key = os.getenv('GOOGLE_CLOUD_VISION_API_KEY')
@@ -27,7 +265,139 @@ class GSEBPDFProcessor:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
             
         genai.configure(api_key=gemini_api_key)
-        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash')
+        self.gemini_model_name = 'gemini-2.0-flash'
+        self.gemini_model = genai.GenerativeModel(self.gemini_model_name)
+        
+        # Per-page image descriptions come back as a JSON array of strings
+        self.description_list_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=list[str]
+        )
+        
+        # Diagram detections come back as a JSON array of description objects
+        self.detection_list_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema={
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "description": {"type": "string"},
+                        "educational_context": {"type": "string"}
+                    },
+                    "required": ["description", "educational_context"]
+                }
+            }
+        )
+        
+        # Explicit Gemini context caches for repeated prompt prefixes, per run. The
+        # TTL must outlast the longest step that uses a cache (a whole book's pages);
+        # process_pdf deletes the caches when it finishes, so it rarely runs out.
+        self.prompt_caches = {}
+        self.prompt_cache_lock = threading.Lock()
+        self.prompt_cache_ttl_seconds = 3600
+        
+        # Page text sent for summarization is capped (input tokens are billed) after
+        # dropping header/footer lines: a line within the first/last few lines of a page,
+        # with some letters (not an equation fragment such as "=" or "(1)"), repeated on
+        # more than this share of pages. Running heads alternate between facing pages
+        # (title / "ગણિત"), so each is on about half of them.
+        self.summary_max_chars = int(os.getenv('SUMMARY_MAX_CHARS', '6000'))
+        self.boilerplate_page_share = 0.3
+        self.boilerplate_edge_lines = 5
+        self.boilerplate_min_chars = 4
+        
+        # Topic assignment sends this many pages per request, answered as JSON
+        self.topic_batch_size = 10
+        self.topic_batch_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema={
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "page_number": {"type": "integer"},
+                        "topic_numbers": {"type": "array", "items": {"type": "integer"}}
+                    },
+                    "required": ["page_number", "topic_numbers"]
+                }
+            }
+        )
+        # Per-page fallback requests come back as a JSON array of topic numbers
+        self.topic_list_config = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=list[int]
+        )
+        
+        # Pages with fewer non-whitespace characters than this (blank, figure-only or
+        # page-number-only pages) get no topics without asking Gemini
+        self.min_topic_text_chars = 100
+        
+        # Pages whose text samples are at least this similar (Jaccard over character
+        # shingles, digits masked) share one topic assignment instead of one request each
+        self.topic_duplicate_similarity = 0.92
+        
+        # Pages shorter than this (blank pages, headers) skip Gemini diagram detection
+        self.min_detection_text_chars = 80
+        
+        # Page data is checkpointed after each page-level stage, so a failed run
+        # resumes without re-spending Vision/Gemini quota on finished stages
+        self.checkpoint_dir = os.path.join('data', 'checkpoints')
+        
+        # Response texts cached on disk by model, full prompt and generation config
+        # (GEMINI_RESPONSE_CACHE=0 always calls Gemini, e.g. while iterating on prompts)
+        self.response_cache = GeminiResponseCache() if os.getenv('GEMINI_RESPONSE_CACHE', '1') != '0' else None
+        
+        # Description and summary calls run concurrently on one event loop (the
+        # SDK's async gRPC channel is bound to the loop it was first used on)
+        self.loop = asyncio.new_event_loop()
+        self.gemini_max_concurrency = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+        # Image descriptions can be held to fewer in-flight requests (e.g. 3) when the
+        # quota is tight; by default they use the general cap
+        self.description_max_concurrency = int(os.getenv('DESCRIPTION_MAX_CONCURRENCY', str(self.gemini_max_concurrency)))
+        self.gemini_max_attempts = 5
+        # Transient 429/503 responses are retried with jittered exponential backoff
+        # (sync and async calls alike); other errors fail the call straight away
+        self.gemini_retry_policy = dict(
+            stop=stop_after_attempt(self.gemini_max_attempts),
+            wait=wait_exponential_jitter(initial=1, max=30),
+            retry=retry_if_exception_type((ResourceExhausted, ServiceUnavailable)),
+            before_sleep=self._log_gemini_retry,
+            reraise=True,
+        )
+        
+        # Concurrent calls are paced to the Gemini per-minute quota instead of
+        # fixed sleeps between calls
+        self.gemini_rate_limiter = RateLimiter(max_calls=int(os.getenv('GEMINI_RPM', '60')), period=60)
+        
+        # Vision is called over gRPC (raw image bytes on one HTTP/2 channel) unless
+        # VISION_TRANSPORT=rest, which sends base64 JSON to images:annotate
+        self.vision_transport = os.getenv('VISION_TRANSPORT', 'grpc').lower()
+        if self.vision_transport == "grpc":
+            self.vision_client = vision.ImageAnnotatorClient(client_options={"api_key": self.vision_api_key})
+            self.vision_retry = retries.Retry(
+                predicate=retries.if_exception_type(ResourceExhausted, ServiceUnavailable),
+                initial=1.0, maximum=32.0, multiplier=2.0, timeout=300.0
+            )
+        
+        # Pages are rasterized for OCR only: 200 DPI JPEG keeps Vision accuracy at a
+        # fraction of the bytes of 300 DPI PNG
+        self.pdf_dpi = int(os.getenv('PDF_DPI', '200'))
+        self.jpeg_quality = 85
+        self.render_workers = min(16, os.cpu_count() or 1)
+        
+        # Vision BatchAnnotateImages limits: 16 images and ~10 MB per request. Batches
+        # are flushed at 8 MB of image payload to leave room for the rest of the request.
+        self.vision_batch_size = 16
+        self.vision_max_request_bytes = 8 * 1024 * 1024
+        self.vision_max_attempts = 5
+        
+        # Batches are sent from a thread pool over one HTTP/2 client, so in-flight
+        # requests multiplex over a single TCP/TLS connection
+        self.vision_max_workers = int(os.getenv('VISION_MAX_WORKERS', '8'))
+        self.http = httpx.Client(http2=True, timeout=60.0, limits=httpx.Limits(max_connections=16))
+        weakref.finalize(self, self.http.close)
+        self.api_calls_lock = threading.Lock()
         
         # API call counters
         self.api_calls = {
@@ -40,6 +410,18 @@ class GSEBPDFProcessor:
         # Class 10 Maths Gujarati specific prompts
         self.prompts = self._load_subject_prompts()
         
+        # Templates split around their first per-call field (see _prompt_parts): the
+        # text before it is the static prefix that gets a Gemini prompt cache
+        self.prompt_split_fields = {
+            "page_summarization": "page_text",
+            "image_descriptions": "context",
+            "topic_assignment": "page_text",
+            "topic_assignment_batch": "pages_block",
+        }
+        for prompt_key, variable in self.prompt_split_fields.items():
+            if self.prompts[prompt_key].count("{" + variable + "}") != 1:
+                raise ValueError(f"Prompt '{prompt_key}' must contain {{{variable}}} exactly once")
+        
         print("🔧 Initialized GSEB PDF Processor")
         print(f"🔑 Vision API Key: {'✅ Loaded' if self.vision_api_key else '❌ Missing'}")
         print(f"🔑 Gemini API Key: {'✅ Loaded' if gemini_api_key else '❌ Missing'}")
@@ -91,25 +473,90 @@ class GSEBPDFProcessor:
             - એક જ વિષય બે વખત ન આવવો જોઈએ
             - ફક્ત સૌથી સંબંધિત વિષયો પસંદ કરો
             
+            ઉપલબ્ધ વિષયો:
+            {topics_list}
+            
+            ફક્ત વિષય નંબરો ધરાવતો JSON array આપો.
+            
             પાનાની સામગ્રી: {page_text}
+            """,
+            "topic_assignment_batch": """
+            નીચેના દરેક પાનાની સામગ્રી અને વિષયોની યાદીના આધારે, દરેક પાનાને સંબંધિત વિષયોના નંબર આપો.
+            
+            નિયમો:
+            - એક પાનામાં બહુવિધ વિષયો હોઈ શકે
+            - એક પાનામાં એક જ વિષય બે વખત ન આવવો જોઈએ
+            - ફક્ત સૌથી સંબંધિત વિષયો પસંદ કરો
             
             ઉપલબ્ધ વિષયો:
             {topics_list}
             
-            ફક્ત વિષય નંબરો આપો (comma separated):
+            દરેક પાના માટે તેનો પાના નંબર અને વિષય નંબરો ધરાવતો JSON object આપો.
+            
+            પાનાઓ:
+            {pages_block}
             """,
-            "image_description": """
-            આ ગણિતના ચિત્રનું શૈક્ષણિક વર્ણન ગુજરાતીમાં આપો:
+            "image_descriptions": """
+            આ ગણિતના પાનાના દરેક ચિત્રનું શૈક્ષણિક વર્ણન ગુજરાતીમાં આપો (શું દેખાય છે, કેવા ઉપયોગ માટે છે).
             
-            ચિત્રમાં જે દેખાય છે: {image_content}
+            ચિત્રોના ક્રમમાં જ, દરેક ચિત્ર માટે એક વર્ણન ધરાવતો JSON array આપો.
             
             સંદર્ભ: વર્ગ 10 ગણિત - {context}
             
-            ગુજરાતીમાં શૈક્ષણિક વર્ણન આપો (શું દેખાય છે, કેવા ઉપયોગ માટે છે):
+            ચિત્રોમાં જે દેખાય છે:
+            {image_content}
             """
         }
     
 
+    def _prompt_parts(self, prompt_key, **values):
+        """
+        Split a template around its per-call field from prompt_split_fields and
+        format both halves with the remaining values. The caller sends
+        prefix, field value, tail as separate parts, so only the prefix is cached.
+        """
+        prefix, tail = self.prompts[prompt_key].split("{" + self.prompt_split_fields[prompt_key] + "}")
+        return prefix.format(**values), tail.format(**values)
+
+    def _cached_prompt(self, cache_key, prefix, *suffix_parts):
+        """
+        Return (model, contents) for a prompt whose prefix repeats across calls.
+        The prefix goes into a Gemini CachedContent once per cache_key and only the
+        suffix parts are sent; if caching is unavailable (e.g. the prefix is under the
+        model's minimum cacheable size) the prefix is sent as the first part to the
+        plain model. Parts are sent as a list, so page text is never copied into one
+        concatenated prompt string.
+        """
+        with self.prompt_cache_lock:
+            if cache_key not in self.prompt_caches:
+                try:
+                    cache = genai.caching.CachedContent.create(
+                        model=self.gemini_model_name,
+                        contents=[prefix],
+                        ttl=timedelta(seconds=self.prompt_cache_ttl_seconds)
+                    )
+                    self.prompt_caches[cache_key] = (cache, genai.GenerativeModel.from_cached_content(cache))
+                    print(f"🗄️ Created Gemini prompt cache for {cache_key if isinstance(cache_key, str) else cache_key[0]}")
+                except Exception as e:
+                    print(f"ℹ️ Prompt caching unavailable, sending full prompts: {str(e)[:100]}")
+                    self.prompt_caches[cache_key] = None
+            cached = self.prompt_caches[cache_key]
+        
+        if cached is None:
+            return self.gemini_model, [prefix, *suffix_parts]
+        return cached[1], list(suffix_parts)
+
+    def clear_prompt_caches(self):
+        """Delete the Gemini prompt caches created during this run"""
+        for cached in self.prompt_caches.values():
+            if cached is None:
+                continue
+            try:
+                cached[0].delete()
+            except Exception as e:
+                print(f"⚠️ Could not delete prompt cache: {str(e)[:100]}")
+        self.prompt_caches.clear()
+
     def extract_pdf_with_images(self, pdf_path):
         """Extract text and images from PDF with enhanced detection capabilities"""
         print("\n" + "="*50)
@@ -120,89 +567,54 @@ class GSEBPDFProcessor:
         
         start_time = time.time()
         
-        # Convert PDF to images using pdf2image
+        # Pages are rasterized as the loop below needs them (a few pages ahead, in
+        # parallel), so only those pages' JPEG bytes are in memory rather than the whole book
         try:
-            images = convert_from_path(pdf_path, dpi=300, fmt='png')
-            print(f"📄 Converted {len(images)} pages to images")
+            page_count = pdfinfo_from_path(pdf_path)["Pages"]
+            print(f"📄 PDF has {page_count} pages")
         except Exception as e:
-            print(f"❌ Failed to convert PDF to images: {str(e)[:100]}...")
+            print(f"❌ Failed to read PDF: {str(e)[:100]}...")
             return []
         
-        pages_data = []
-        
-        for page_idx, image in enumerate(tqdm(images, desc="Processing pages")):
-            # Convert image to bytes
-            img_buffer = BytesIO()
-            image.save(img_buffer, format="PNG")
-            img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-            img_buffer.close()
-            
-            file_size = len(img_base64) / (1024 * 1024)  # MB
-            print(f"📄 Page {page_idx+1} image size: {file_size:.2f} MB")
-            
-            # ENHANCED: Prepare API request with multiple detection features
-            api_url = f"https://vision.googleapis.com/v1/images:annotate?key={self.vision_api_key}"
-            
-            request_payload = {
-                "requests": [
-                    {
-                        "image": {
-                            "content": img_base64
-                        },
-                        "features": [
-                            {
-                                "type": "TEXT_DETECTION",
-                                "maxResults": 100
-                            },
-                            {
-                                "type": "DOCUMENT_TEXT_DETECTION"  # NEW: Better for structured content
-                            },
-                            {
-                                "type": "OBJECT_LOCALIZATION",
-                                "maxResults": 20
-                            }
-                        ],
-                        "imageContext": {
-                            "languageHints": ["gu", "en"]  # Gujarati and English
-                        }
-                    }
-                ]
-            }
-            
-            print(f"🚀 Sending enhanced image request for page {page_idx+1} to Google Vision API...")
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(api_url, json=request_payload, headers=headers)
-            
-            # Count Vision API call
-            self.api_calls["vision_api"] += 1
-            print(f"📊 Vision API Call #{self.api_calls['vision_api']} completed for page {page_idx+1}")
-            
-            if response.status_code != 200:
-                print(f"❌ Vision API Error for page {page_idx+1}: {response.status_code}")
-                print(f"🔍 Error details: {response.text[:200]}...")
-                pages_data.append({
-                    "page_number": page_idx + 1,
-                    "text": "",
-                    "images": [],
-                    "extracted_at": datetime.now().isoformat(),
-                    "error": f"Vision API error: {response.status_code} - {response.text[:200]}"
-                })
-                continue
+        # Pages are packed into BatchAnnotateImages requests (up to vision_batch_size
+        # images, kept under vision_max_request_bytes) so N pages cost N/16 round trips.
+        # Each batch is sent from the pool as soon as it is full, overlapping encoding
+        # with the requests already in flight.
+        futures = []
+        batch = []
+        batch_bytes = 0
+        
+        with ThreadPoolExecutor(max_workers=self.vision_max_workers) as executor:
+            for page_number, img_bytes in tqdm(self._render_pages(pdf_path, page_count),
+                                               total=page_count, desc="Processing pages"):
+                # REST sends the image base64-encoded, a third larger than the raw bytes
+                payload_size = len(img_bytes) if self.vision_transport == "grpc" else (len(img_bytes) + 2) // 3 * 4
+                logger.debug(f"📄 Page {page_number} image size: {payload_size / (1024 * 1024):.2f} MB")
+                
+                if batch and (len(batch) >= self.vision_batch_size
+                              or batch_bytes + payload_size > self.vision_max_request_bytes):
+                    futures.append(executor.submit(self._annotate_page_batch, batch))
+                    batch = []
+                    batch_bytes = 0
+                
+                batch.append((page_number, img_bytes))
+                batch_bytes += payload_size
             
-            result = response.json()
-            print(f"🔍 API Response for page {page_idx+1}: {json.dumps(result, ensure_ascii=False, indent=2)[:500]}...")
+            if batch:
+                futures.append(executor.submit(self._annotate_page_batch, batch))
             
-            # ENHANCED: Process response with multiple detection methods
-            page_data = self._process_enhanced_vision_response(result, page_idx + 1)
-            pages_data.append(page_data)
-            time.sleep(1)  # Rate limiting
+            # Futures are in submission order, so pages stay in page order
+            pages_data = [page_data for future in futures for page_data in future.result()]
+        
+        # Gemini diagram detection for all pages at once, concurrently
+        self.detect_mathematical_content_for_pages(pages_data)
         
         processing_time = time.time() - start_time
         total_images = sum(len(page.get('images', [])) for page in pages_data)
         total_characters = sum(len(page.get('text', '')) for page in pages_data)
         
         print("\n✅ ENHANCED PDF EXTRACTION COMPLETED")
-        print(f"📄 Pages extracted: {len(pages_data)} / {len(images)}")
+        print(f"📄 Pages extracted: {len(pages_data)} / {page_count}")
         print(f"🖼️ Images/diagrams detected: {total_images}")
         print(f"🔍 Total characters extracted: {total_characters}")
         print(f"⏱️ Processing time: {processing_time:.2f} seconds")
@@ -210,44 +622,239 @@ class GSEBPDFProcessor:
         
         return pages_data
 
-    def _process_enhanced_vision_response(self, result, page_number):
+    def _render_pages(self, pdf_path, page_count):
+        """
+        Yield (page_number, JPEG bytes) for each PDF page in order.
+        Pages render in parallel (each is its own pdftoppm process), with at most
+        2 x render_workers pages rendered ahead of the consumer to bound memory.
+        """
+        with ThreadPoolExecutor(max_workers=self.render_workers) as pool:
+            pending = deque()
+            for page_number in range(1, page_count + 1):
+                pending.append((page_number, pool.submit(self._render_page, pdf_path, page_number)))
+                if len(pending) >= self.render_workers * 2:
+                    done_page, future = pending.popleft()
+                    yield done_page, future.result()
+            
+            while pending:
+                done_page, future = pending.popleft()
+                yield done_page, future.result()
+
+    def _render_page(self, pdf_path, page_number):
+        """
+        Rasterize a single PDF page and return its JPEG bytes.
+        pdftoppm already writes the JPEG, so the file is read back as-is rather
+        than decoded into a PIL image and re-encoded.
+        """
+        with tempfile.TemporaryDirectory() as output_folder:
+            paths = convert_from_path(
+                pdf_path, dpi=self.pdf_dpi, fmt='jpeg', first_page=page_number, last_page=page_number,
+                jpegopt={"quality": self.jpeg_quality, "optimize": True},
+                output_folder=output_folder, paths_only=True
+            )
+            with open(paths[0], 'rb') as f:
+                return f.read()
+
+    def _annotate_page_batch(self, batch):
+        """Send one BatchAnnotateImages request for several pages and process each response"""
+        page_numbers = [page_number for page_number, _ in batch]
+        
+        logger.debug(f"🚀 Sending batch request for pages {page_numbers[0]}-{page_numbers[-1]} to Google Vision API ({self.vision_transport})...")
+        if self.vision_transport == "grpc":
+            responses, error = self._batch_annotate_grpc(batch)
+        else:
+            responses, error = self._batch_annotate_rest(batch)
+        
+        # Count Vision API call (batches run on several threads)
+        with self.api_calls_lock:
+            self.api_calls["vision_api"] += 1
+            call_number = self.api_calls["vision_api"]
+        logger.debug(f"📊 Vision API Call #{call_number} completed for {len(batch)} pages")
+        
+        # One timestamp for the whole batch (its pages come from the same call)
+        extracted_at = datetime.now().isoformat()
+        
+        if error:
+            logger.warning(f"❌ Vision API Error for pages {page_numbers[0]}-{page_numbers[-1]}: {error}")
+            return [{
+                "page_number": page_number,
+                "text": "",
+                "images": [],
+                "extracted_at": extracted_at,
+                "error": f"Vision API error: {error}"
+            } for page_number in page_numbers]
+        
+        # Responses come back in request order
+        batch_pages = []
+        for i, page_number in enumerate(page_numbers):
+            page_response = responses[i] if i < len(responses) else {}
+            if 'error' in page_response:
+                logger.warning(f"❌ Vision API Error for page {page_number}: {page_response['error'].get('message', '')[:200]}")
+                batch_pages.append({
+                    "page_number": page_number,
+                    "text": "",
+                    "images": [],
+                    "extracted_at": extracted_at,
+                    "error": f"Vision API error: {page_response['error'].get('message', '')[:200]}"
+                })
+                continue
+            
+            # ENHANCED: Process response with multiple detection methods
+            page_data = self._process_enhanced_vision_response({"responses": [page_response]}, page_number, extracted_at)
+            batch_pages.append(page_data)
+        
+        return batch_pages
+
+    def _batch_annotate_grpc(self, batch):
+        """
+        BatchAnnotateImages over gRPC: raw JPEG bytes, no base64/JSON wrapping.
+        Returns (responses in the REST JSON shape, error message or None).
+        """
+        # One AnnotateImageRequest per page: document text plus object localization
+        annotate_requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=img_bytes),
+                features=[
+                    vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION),
+                    vision.Feature(type_=vision.Feature.Type.OBJECT_LOCALIZATION, max_results=8)
+                ],
+                image_context=vision.ImageContext(language_hints=["gu", "en"])  # Gujarati and English
+            )
+            for _, img_bytes in batch
+        ]
+        
+        try:
+            result = self.vision_client.batch_annotate_images(requests=annotate_requests, retry=self.vision_retry)
+        except GoogleAPIError as e:
+            # Includes RetryError once vision_retry's deadline runs out; the batch's pages
+            # get error entries and the other batches' OCR is kept
+            return None, str(e)[:200]
+        
+        return [self._vision_response_dict(response) for response in result.responses], None
+
+    @staticmethod
+    def _vision_response_dict(response):
+        """Copy the fields the pipeline reads from a gRPC AnnotateImageResponse into the REST JSON shape"""
+        if response.error.message:
+            return {"error": {"message": response.error.message}}
+        
+        page_response = {}
+        if response.full_text_annotation.text:
+            page_response["fullTextAnnotation"] = {"text": response.full_text_annotation.text}
+        if response.localized_object_annotations:
+            page_response["localizedObjectAnnotations"] = [
+                {"name": obj.name, "score": obj.score} for obj in response.localized_object_annotations
+            ]
+        return page_response
+
+    def _batch_annotate_rest(self, batch):
+        """
+        BatchAnnotateImages over REST (base64 images in JSON).
+        Returns (responses, error message or None).
+        """
+        # One AnnotateImageRequest per page: document text plus object localization
+        request_payload = {
+            "requests": [
+                {
+                    "image": {
+                        "content": base64.b64encode(img_bytes).decode('utf-8')
+                    },
+                    "features": [
+                        {
+                            "type": "DOCUMENT_TEXT_DETECTION"
+                        },
+                        {
+                            "type": "OBJECT_LOCALIZATION",
+                            "maxResults": 8  # Textbook pages rarely have more diagrams
+                        }
+                    ],
+                    "imageContext": {
+                        "languageHints": ["gu", "en"]  # Gujarati and English
+                    }
+                }
+                for _, img_bytes in batch
+            ]
+        }
+        
+        try:
+            response = self._post_vision_request(request_payload)
+        except httpx.TransportError as e:
+            return None, f"{type(e).__name__}: {str(e)[:200]}"
+        if response.status_code != 200:
+            print(f"🔍 Error details: {response.text[:200]}...")
+            return None, f"{response.status_code} - {response.text[:200]}"
+        
+        # orjson decodes these multi-hundred-KB responses several times faster than json
+        result = orjson.loads(response.content)
+        responses = result.get('responses', [])
+        
+        # Summarize rather than pretty-printing the whole (multi-MB) response
+        text_chars = sum(len(r.get('fullTextAnnotation', {}).get('text', '')) for r in responses)
+        logger.debug(f"🔍 API Response: {len(responses)} page responses, {text_chars} characters of text")
+        return responses, None
+
+    def _post_vision_request(self, request_payload):
+        """
+        POST to images:annotate, backing off on HTTP 429 (honoring Retry-After) and on
+        transport errors (dropped HTTP/2 streams, timeouts), which are re-raised once
+        the attempts run out
+        """
+        api_url = f"https://vision.googleapis.com/v1/images:annotate?key={self.vision_api_key}"
+        headers = {'Content-Type': 'application/json'}
+        body = orjson.dumps(request_payload)
+        
+        for attempt in range(self.vision_max_attempts):
+            last_attempt = attempt == self.vision_max_attempts - 1
+            try:
+                response = self.http.post(api_url, content=body, headers=headers)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"⏳ Vision API request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            
+            if response.status_code != 429 or last_attempt:
+                return response
+            
+            retry_after = response.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            logger.warning(f"⏳ Vision API rate limit hit, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _process_enhanced_vision_response(self, result, page_number, extracted_at=None):
         """Process enhanced Vision API response with multiple detection methods"""
-        print(f"🔍 Processing enhanced Vision API response for page {page_number}")
+        logger.debug(f"🔍 Processing enhanced Vision API response for page {page_number}")
         
         page_data = {
             "page_number": page_number,
             "text": "",
             "images": [],
-            "extracted_at": datetime.now().isoformat()
+            "extracted_at": extracted_at or datetime.now().isoformat()
         }
         
         if 'responses' not in result or len(result['responses']) == 0:
-            print(f"⚠️ No response data for page {page_number}")
+            logger.warning(f"⚠️ No response data for page {page_number}")
             page_data["error"] = "No response data from Vision API"
             return page_data
         
         page_response = result['responses'][0]
         
-        # Method 1: Extract text using TEXT_DETECTION (existing)
-        if 'textAnnotations' in page_response and page_response['textAnnotations']:
-            page_data["text"] = page_response['textAnnotations'][0].get('description', '')
-            print(f"📄 Page {page_number}: {len(page_data['text'])} characters extracted (TEXT_DETECTION)")
+        # Text extraction using DOCUMENT_TEXT_DETECTION
+        document_text = page_response.get('fullTextAnnotation', {}).get('text', '')
+        if document_text:
+            page_data["text"] = document_text
+            logger.debug(f"📄 Page {page_number}: {len(document_text)} characters extracted (DOCUMENT_TEXT_DETECTION)")
         else:
-            print(f"⚠️ No textAnnotations for page {page_number}")
-            page_data["error"] = "No text extracted from TEXT_DETECTION"
+            logger.warning(f"⚠️ No fullTextAnnotation for page {page_number}")
+            page_data["error"] = "No text extracted from DOCUMENT_TEXT_DETECTION"
         
-        # Method 2: Enhanced text extraction using DOCUMENT_TEXT_DETECTION
-        if 'fullTextAnnotation' in page_response:
-            document_text = page_response['fullTextAnnotation'].get('text', '')
-            if len(document_text) > len(page_data["text"]):
-                page_data["text"] = document_text
-                print(f"📄 Page {page_number}: Enhanced text extraction - {len(document_text)} characters (DOCUMENT_TEXT_DETECTION)")
-        
-        # Method 3: Object detection (existing but enhanced)
+        # Object detection
         detected_objects = []
         if 'localizedObjectAnnotations' in page_response:
             for obj in page_response['localizedObjectAnnotations']:
-                print(f"🖼️ Page {page_number}: Detected object '{obj['name']}' (confidence: {obj.get('score', 0):.2f})")
+                logger.debug(f"🖼️ Page {page_number}: Detected object '{obj['name']}' (confidence: {obj.get('score', 0):.2f})")
                 # Enhanced object type detection
                 if self._is_mathematical_content(obj['name']):
                     detected_objects.append({
@@ -256,156 +863,70 @@ class GSEBPDFProcessor:
                         "detection_method": "vision_object_detection",
                         "raw_detection": obj['name']
                     })
-                    print(f"🖼️ Page {page_number}: Added mathematical object '{obj['name']}' to detection list")
+                    logger.debug(f"🖼️ Page {page_number}: Added mathematical object '{obj['name']}' to detection list")
         
-        # Store initial detections (will be enhanced by Gemini later)
+        # Store initial detections (Gemini detections are added once all pages are extracted)
         page_data["images"] = detected_objects
         
-        chapter_name = getattr(self, "current_chapter", "અજ્ઞાત અધ્યાય")  # You can set before processing
-        ai_detected = self.detect_mathematical_content_with_ai(page_data["text"], chapter_name, page_number)
-
-        for det in ai_detected:
-            page_data["images"].append({
-                "object_type": det,
-                "confidence": 1.0,
-                "detection_method": "gemini_ai_detection",
-                "raw_detection": det
-            })
-        
         return page_data
 
 
     def _is_mathematical_content(self, object_name):
         """Check if detected object is likely mathematical content (English labels from Vision API)"""
-        
-        # English keywords (from Vision API object detection)
-        english_mathematical_keywords = [
-            'diagram', 'chart', 'graph', 'table', 'mathematical expression', 
-            'formula', 'image', 'figure', 'equation', 'plot', 'grid',
-            'coordinate', 'axis', 'line', 'curve', 'geometric', 'triangle',
-            'circle', 'rectangle', 'polygon', 'shape', 'drawing', 'illustration'
-        ]
-        
-        # Gujarati keywords (if Vision API occasionally returns Gujarati labels)
-        gujarati_mathematical_keywords = [
-            'આકૃતિ', 'ચાર્ટ', 'આલેખ', 'કોષ્ટક', 'સૂત્ર', 'સમીકરણ',
-            'ત્રિકોણ', 'વર્તુળ', 'ચતુર્ભુજ', 'રેખાકૃતિ', 'ચિત્ર'
-        ]
-        
-        object_lower = object_name.lower()
-        
-        # Check English keywords (primary check)
-        for keyword in english_mathematical_keywords:
-            if keyword in object_lower:
-                print(f"✅ Mathematical content detected (English): '{object_name}' contains '{keyword}'")
-                return True
-        
-        # Check Gujarati keywords (fallback check)
-        for keyword in gujarati_mathematical_keywords:
-            if keyword in object_name:
-                print(f"✅ Mathematical content detected (Gujarati): '{object_name}' contains '{keyword}'")
-                return True
-        
-        print(f"❌ Non-mathematical content: '{object_name}'")
-        return False
-
+        return _is_mathematical_label(object_name)
 
+    def detect_mathematical_content_for_pages(self, pages_data):
+        """Run AI diagram detection for every page concurrently, adding detections to each page's images"""
+        chapter_name = getattr(self, "current_chapter", "અજ્ઞાત અધ્યાય")  # You can set before processing
         
+        jobs = []
+        for page in pages_data:
+            request = self._detection_request(page["text"], chapter_name, page["page_number"])
+            if request is not None:
+                jobs.append((page, *request))
+        
+        if not jobs:
+            return
+        
+        print(f"🔄 Sending {len(jobs)} diagram detection requests to Gemini API...")
+        responses = self.loop.run_until_complete(
+            self._generate_all_async([prompt for _, _, prompt, _ in jobs], [key for _, _, _, key in jobs],
+                                     desc="🔍 Detecting diagrams", model=jobs[0][1],
+                                     generation_config=self.detection_list_config, parse=self._parse_json_list)
+        )
+        
+        for (page, _, _, _), detections in zip(jobs, responses):
+            if isinstance(detections, Exception):
+                logger.warning(f"⚠️ Page {page['page_number']}: AI diagram detection failed: {str(detections)[:100]}...")
+                continue
+            
+            for det in detections:
+                page["images"].append({
+                    "object_type": det,
+                    "confidence": 1.0,
+                    "detection_method": "gemini_ai_detection",
+                    "raw_detection": det
+                })
 
-    def detect_mathematical_content_with_ai(self, page_text, chapter_name, page_number):
-        """Detect and describe mathematical diagrams in Gujarati with chapter-aware hints"""
-        
-        chapter_content_map = {
-        "વાસ્તવિક સંખ્યાઓ": [
-            "સંખ્યા રેખા પર દર્શાવેલી સંખ્યાઓ",
-            "મૂળાંક સાથે સંબંધિત આકૃતિઓ"
-        ],
-        "બહુપદીઓ": [
-            "બહુપદીઓના ગ્રાફ",
-            "મૂળ અને ગુણાકાર દર્શાવતી આકૃતિઓ"
-        ],
-        "દ્વિચલ સુરેખ સમીકરણયુગ્મ": [
-            "સમીકરણના ગ્રાફ",
-            "કોષ્ટક",
-            "રેખાઓના intersection"
-        ],
-        "દ્વિઘાત સમીકરણ": [
-            "પેરાબોલાનો ગ્રાફ",
-            "વિભિન્ન કેસ માટેના ગ્રાફ (વાસ્તવિક મૂળ, કલ્પિત મૂળ)",
-            "વર્ટેક્સ દર્શાવતો ગ્રાફ"
-        ],
-        "સમાન્તર શ્રેણી": [
-            "અનુક્રમ દર્શાવતી કોષ્ટક",
-            "આનુક્રમિક સંખ્યાઓ દર્શાવતો આલેખ"
-        ],
-        "ત્રિકોણ": [
-            "ત્રિકોણની રચના",
-            "સમાનતા દર્શાવતી આકૃતિઓ",
-            "પ્રમાણ દર્શાવતી આકૃતિઓ"
-        ],
-        "યામ ભૂમિતિ": [
-            "અક્ષાંકો પરના બિંદુઓ",
-            "અંતર સૂત્ર",
-            "વિભાગ સૂત્ર",
-            "ત્રિકોણનું ક્ષેત્રફળ દર્શાવતી આકૃતિ"
-        ],
-        "ત્રિકોણમિતિ નો પરિચય": [
-            "સમકોણ ત્રિકોણમાં ત્રિકોણમિતીય ગુણોત્તર",
-            "યૂનિટ સર્કલ"
-        ],
-        "ત્રિકોણમિતિ ના ઉપયોગો": [
-            "ઊંચાઈ અને અંતર દર્શાવતી આકૃતિઓ",
-            "કોણ ઉન્નતિ અને અવનીતિ"
-        ],
-        "વર્તુળ": [
-            "વર્તુળ",
-            "સ્પર્શક",
-            "જ્યોતિ",
-            "ત્રજ્યા"
-        ],
-        "રચના": [
-            "કંપાસથી રચના",
-            "કોણ દ્વિભાજક",
-            "ત્રિકોણની રચના"
-        ],
-        "વર્તુળ સંબંધિત ક્ષેત્રફળ": [
-            "વર્તુળનો ક્ષેત્રફળ",
-            "સેક્ટર",
-            "સેગમેન્ટ"
-        ],
-        "પૃષ્ઠફળ અને ઘનફળ": [
-            "ઘનાકૃતિઓના આલેખ",
-            "સિલિન્ડર",
-            "શંકુ",
-            "ગોળાકાર"
-        ],
-        "આંકડાશાસ્ત્ર": [
-            "હિસ્ટોગ્રામ",
-            "બાર ચાર્ટ",
-            "આવર્તન કોષ્ટક",
-            "પાઈ ચાર્ટ"
-        ],
-        "સંભાવના": [
-            "સંભાવના વૃક્ષ",
-            "પ્રયોગોના આકૃતિઓ",
-            "નમૂના સ્થાન"
-            ]
-        }
+    def _detection_request(self, page_text, chapter_name, page_number):
+        """(model, prompt, response-cache key) for a page's diagram detection, or None if the page is skipped"""
+        # Cheap gate: no Gemini call for near-empty pages or text with no diagram vocabulary
+        if len(page_text) < self.min_detection_text_chars or not _chapter_content_re(chapter_name).search(page_text.lower()):
+            logger.debug(f"ℹ️ Page {page_number}: No mathematical content keywords, skipping AI diagram detection")
+            return None
         
-        expected_content = chapter_content_map.get(chapter_name, [])
+        expected_content = CHAPTER_CONTENT_MAP.get(chapter_name, ())
         
-        prompt = f"""
-        તમે ધોરણ 10 ગણિતના પાઠ્યપુસ્તકના અધ્યાય "{chapter_name}" નું પાનું {page_number} વાંચી રહ્યા છો. 
+        # Chapter-level instructions first, page text last, so the prefix can be cached
+        prefix = f"""
+        તમે ધોરણ 10 ગણિતના પાઠ્યપુસ્તકના અધ્યાય "{chapter_name}" નું એક પાનું વાંચી રહ્યા છો. 
 
         આ અધ્યાયમાં સામાન્ય રીતે જોવા મળતી આકૃતિઓ: {', '.join(expected_content)}.
 
         નીચેના લખાણને આધારે ઓળખો કે આ પાનામાં કઈ આકૃતિઓ છે. 
         દરેક માટે સ્પષ્ટ ગુજરાતી વર્ણન અને શૈક્ષણિક હેતુ આપો.
 
-        લખાણ:
-        {page_text}
-
-        ફક્ત આ ફોર્મેટમાં JSON return કરો (કોઈ વધારાનો લખાણ નહીં):
+        ઉદાહરણ:
         [
         {{
             "description": "x + y = 5 નું સુરેખ સમીકરણ દર્શાવતો ગ્રાફ જેમાં રેખા (0,5) અને (5,0) પરથી પસાર થાય છે.",
@@ -414,22 +935,13 @@ class GSEBPDFProcessor:
         ]
         જો આકૃતિ ન હોય તો ખાલી array [] return કરો.
         """
+        suffix = f"""
+        પાનું {page_number} નું લખાણ:
+        {page_text}
+        """
         
-        response = self.gemini_model.generate_content(prompt)
-        text = response.text.strip()
-        
-        # 🛠️ Clean out markdown fences if Gemini adds them
-        if text.startswith("```"):
-            text = text.strip("`")
-            if text.lower().startswith("json"):
-                text = text[4:].strip()
-        
-        try:
-            detections = json.loads(text)
-            return detections if isinstance(detections, list) else []
-        except Exception:
-            print(f"⚠️ Gemini response parsing error (cleaned): {text[:200]}")
-            return []
+        model, prompt = self._cached_prompt(("math_content_detection", chapter_name), prefix, suffix)
+        return model, prompt, self._response_key(prefix, suffix, generation_config=self.detection_list_config)
 
   
     def describe_images_with_ai(self, pages_data):
@@ -450,36 +962,49 @@ class GSEBPDFProcessor:
         successful_descriptions = 0
         failed_descriptions = 0
         
-        for page in tqdm(pages_data, desc="Describing images"):
+        # One prompt per page covering all of its images (answered as a JSON array
+        # in image order); the pages' prompts are then sent concurrently
+        jobs = []
+        model = self.gemini_model
+        for page in pages_data:
             if not page.get("images"):
-                print(f"📄 Page {page['page_number']}: No images to describe")
+                logger.debug(f"📄 Page {page['page_number']}: No images to describe")
                 continue
             
-            print(f"📄 Page {page['page_number']}: Processing {len(page['images'])} images")
-            for image in page["images"]:
-                try:
-                    object_type = image["object_type"]
-                    confidence = image["confidence"]
-                    context = f"Page {page['page_number']} of Class 10 Mathematics textbook"
-                    
-                    prompt = self.prompts["image_description"].format(
-                        image_content=f"{object_type} (confidence: {confidence:.2f})",
-                        context=context
-                    )
-                    
-                    print(f"  🔄 Sending image description request for {object_type} to Gemini API...")
-                    response = self.gemini_model.generate_content(prompt)
-                    
-                    self.api_calls["gemini_api"] += 1
+            logger.debug(f"📄 Page {page['page_number']}: Processing {len(page['images'])} images")
+            image_content = "\n".join(
+                f"{i}. {image['object_type']} (confidence: {image['confidence']:.2f})"
+                for i, image in enumerate(page["images"], 1)
+            )
+            context = f"Page {page['page_number']} of Class 10 Mathematics textbook"
+            
+            prefix, tail = self._prompt_parts("image_descriptions", image_content=image_content)
+            model, prompt = self._cached_prompt("image_descriptions", prefix, context, tail)
+            jobs.append((page, prompt, self._response_key(prefix, context, tail, generation_config=self.description_list_config)))
+        
+        print(f"  🔄 Sending {len(jobs)} image description requests to Gemini API...")
+        responses = self.loop.run_until_complete(
+            self._generate_all_async([prompt for _, prompt, _ in jobs], [key for _, _, key in jobs],
+                                     desc="Describing images", model=model,
+                                     generation_config=self.description_list_config,
+                                     max_concurrency=self.description_max_concurrency,
+                                     parse=[partial(self._parse_json_list, length=len(page["images"])) for page, _, _ in jobs])
+        )
+        
+        for (page, _, _), descriptions in zip(jobs, responses):
+            images = page["images"]
+            try:
+                if isinstance(descriptions, Exception):
+                    raise descriptions
+                
+                for image, description in zip(images, descriptions):
+                    image["educational_description"] = str(description)
                     successful_descriptions += 1
-                    
-                    image["educational_description"] = response.text
-                    print(f"  ✅ Description generated for {object_type} ({len(response.text)} characters)")
-                    
-                    time.sleep(1)
-                except Exception as e:
-                    failed_descriptions += 1
-                    print(f"  ❌ Error describing {object_type}: {str(e)[:100]}...")
+                    logger.debug(f"  ✅ Description generated for {image['object_type']} ({len(str(description))} characters)")
+            except Exception as e:
+                failed_descriptions += len(images)
+                logger.warning(f"  ❌ Error describing page {page['page_number']} images: {str(e)[:100]}...")
+                for image in images:
                     image["educational_description"] = "વર્ણન ઉપલબ્ધ નથી"
         
         processing_time = time.time() - start_time
@@ -488,11 +1013,101 @@ class GSEBPDFProcessor:
         print(f"🖼️ Successful descriptions: {successful_descriptions}")
         print(f"❌ Failed descriptions: {failed_descriptions}")
         print(f"⏱️ Processing time: {processing_time:.2f} seconds")
-        print(f"📊 Gemini API calls for descriptions: {successful_descriptions}")
+        print(f"📊 Gemini API calls for descriptions: {len(jobs)}")
         print(f"📊 Total Gemini API calls so far: {self.api_calls['gemini_api']}")
         
         return pages_data
     
+    def _response_key(self, *prompt_parts, generation_config=None):
+        """Response-cache key; prompt_parts cover the whole prompt even when only its suffix is sent"""
+        return GeminiResponseCache.make_key(
+            self.RESPONSE_CACHE_VERSION, self.gemini_model_name, generation_config, *prompt_parts
+        )
+
+    def _generate_text(self, prompt, cache_key, model=None, generation_config=None, parse=None):
+        """One synchronous Gemini call returning response text (or parse(text)), served from the response cache when possible"""
+        cached = self._cached_response(cache_key, parse)
+        if cached is not None:
+            return cached
+        
+        model = model or self.gemini_model
+        for attempt in Retrying(**self.gemini_retry_policy):
+            with attempt:
+                text = model.generate_content(prompt, generation_config=generation_config).text
+        
+        with self.api_calls_lock:
+            self.api_calls["gemini_api"] += 1
+        return self._accept_response(cache_key, text, parse)
+
+    def _cached_response(self, cache_key, parse=None):
+        """Cached reply for cache_key (parsed if parse is given), or None on a miss or an entry parse rejects"""
+        text = self.response_cache.get(cache_key) if self.response_cache is not None else None
+        if text is None or parse is None:
+            return text
+        try:
+            return parse(text)
+        except Exception:
+            return None
+
+    def _accept_response(self, cache_key, text, parse=None):
+        """
+        Parse a fresh reply (parse raises on a reply the caller can't use) and only
+        then cache it, so a malformed reply is asked for again on the next run
+        instead of being replayed from disk
+        """
+        result = parse(text) if parse is not None else text
+        if self.response_cache is not None:
+            self.response_cache.set(cache_key, text)
+        return result
+
+    async def _generate_all_async(self, prompts, cache_keys, desc, model=None, generation_config=None,
+                                  max_concurrency=None, parse=None):
+        """
+        Send prompts to Gemini concurrently (bounded by a semaphore); exceptions are returned in place.
+        parse is applied to every reply, or is a list with one parser per prompt.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.gemini_max_concurrency)
+        progress = tqdm(total=len(prompts), desc=desc)
+        parsers = parse if isinstance(parse, list) else [parse] * len(prompts)
+        
+        async def generate(prompt, cache_key, parse):
+            try:
+                return await self._generate_async(prompt, cache_key, semaphore, model, generation_config, parse)
+            finally:
+                progress.update(1)
+        
+        try:
+            return await asyncio.gather(*(generate(prompt, cache_key, parse)
+                                          for prompt, cache_key, parse in zip(prompts, cache_keys, parsers)),
+                                        return_exceptions=True)
+        finally:
+            progress.close()
+    
+    async def _generate_async(self, prompt, cache_key, semaphore, model=None, generation_config=None, parse=None):
+        """One Gemini call returning response text or parse(text) (cached once accepted), backing off on 429/503 responses"""
+        cached = self._cached_response(cache_key, parse)
+        if cached is not None:
+            return cached
+        
+        model = model or self.gemini_model
+        async for attempt in AsyncRetrying(**self.gemini_retry_policy):
+            with attempt:
+                async with semaphore, self.gemini_rate_limiter:
+                    response = await model.generate_content_async(prompt, generation_config=generation_config)
+        
+        with self.api_calls_lock:
+            self.api_calls["gemini_api"] += 1
+        return self._accept_response(cache_key, response.text, parse)
+    
+    def _log_gemini_retry(self, retry_state):
+        """tenacity before_sleep hook: halve the request rate on 429s and log the upcoming retry"""
+        error = retry_state.outcome.exception()
+        if isinstance(error, ResourceExhausted):
+            self.gemini_rate_limiter.slow_down()
+            logger.warning(f"  ⏳ Gemini rate limit hit, retrying in {retry_state.next_action.sleep:.1f}s")
+        else:
+            logger.warning(f"  ⏳ Gemini unavailable, retrying in {retry_state.next_action.sleep:.1f}s")
+    
     def integrate_images_in_text(self, pages_data):
         """Integrate image references into page text"""
         print("\n" + "="*50)
@@ -514,22 +1129,18 @@ class GSEBPDFProcessor:
         
         for page in pages_data:
             if page["images"]:
-                print(f"📄 Page {page['page_number']}: Integrating {len(page['images'])} image references")
+                logger.debug(f"📄 Page {page['page_number']}: Integrating {len(page['images'])} image references")
                 
-                image_refs = []
+                page_number = page["page_number"]
                 for i, image in enumerate(page["images"], 1):
-                    ref_text = f"\n[ચિત્ર {i}: {image['educational_description']}]"
-                    image_refs.append(ref_text)
-                    integrated_count += 1
+                    image["reference_id"] = f"ચિત્ર_{page_number}_{i}"
                 
-                original_length = len(page["text"])
-                page["text"] += "".join(image_refs)
-                new_length = len(page["text"])
+                image_refs = "".join([f"\n[ચિત્ર {i}: {image['educational_description']}]"
+                                      for i, image in enumerate(page["images"], 1)])
+                page["text"] += image_refs
+                integrated_count += len(page["images"])
                 
-                print(f"  ✅ Added {len(image_refs)} references (+{new_length - original_length} characters)")
-                
-                for i, image in enumerate(page["images"], 1):
-                    image["reference_id"] = f"ચિત્ર_{page['page_number']}_{i}"
+                logger.debug(f"  ✅ Added {len(page['images'])} references (+{len(image_refs)} characters)")
         
         processing_time = time.time() - start_time
         
@@ -540,6 +1151,28 @@ class GSEBPDFProcessor:
         
         return pages_data
     
+    def _boilerplate_lines(self, pages_data):
+        """Book header/footer lines: lines near a page's top or bottom found on more than boilerplate_page_share of the pages"""
+        if len(pages_data) < 3:
+            return set()
+        
+        line_pages = Counter()
+        for page in pages_data:
+            lines = [line.strip() for line in page["text"].splitlines() if line.strip()]
+            edge = self.boilerplate_edge_lines
+            line_pages.update({
+                line for line in lines[:edge] + lines[-edge:]
+                if len(line) >= self.boilerplate_min_chars and any(char.isalpha() for char in line)
+            })
+        threshold = self.boilerplate_page_share * len(pages_data)
+        return {line for line, count in line_pages.items() if count > threshold}
+
+    def _summary_page_text(self, text, boilerplate):
+        """Page text for the summary prompt: boilerplate lines removed, cut to summary_max_chars"""
+        if boilerplate:
+            text = "\n".join(line for line in text.splitlines() if line.strip() not in boilerplate)
+        return text[:self.summary_max_chars]
+
     def summarize_pages(self, pages_data):
         """Summarize each page using Gemini with image context"""
         print("\n" + "="*50)
@@ -553,43 +1186,53 @@ class GSEBPDFProcessor:
         successful_summaries = 0
         failed_summaries = 0
         
-        for page in tqdm(pages_data, desc="📝 Summarizing pages"):
+        boilerplate = self._boilerplate_lines(pages_data)
+        if boilerplate:
+            print(f"✂️ Dropping {len(boilerplate)} repeated header/footer lines from summary prompts")
+        
+        # Build every prompt first, then send them concurrently
+        prompts = []
+        cache_keys = []
+        model = self.gemini_model
+        for page in pages_data:
+            logger.debug(f"📄 Processing Page {page['page_number']}")
+            
+            image_descriptions = ""
+            if page["images"]:
+                descriptions = [img["educational_description"] for img in page["images"]]
+                image_descriptions = "\n".join(descriptions)
+                logger.debug(f"  🖼️ Including {len(page['images'])} image descriptions")
+            else:
+                image_descriptions = "આ પાનામાં કોઈ ચિત્ર નથી."
+                logger.debug("  📄 No images on this page")
+            
+            page_text = self._summary_page_text(page["text"], boilerplate)
+            logger.debug(f"  📊 Text length: {len(page['text'])} characters ({len(page_text)} sent)")
+            
+            prefix, tail = self._prompt_parts("page_summarization", image_descriptions=image_descriptions)
+            model, prompt = self._cached_prompt("page_summarization", prefix, page_text, tail)
+            prompts.append(prompt)
+            cache_keys.append(self._response_key(prefix, page_text, tail))
+        
+        print(f"  🔄 Sending {len(prompts)} summary requests to Gemini API...")
+        responses = self.loop.run_until_complete(
+            self._generate_all_async(prompts, cache_keys, desc="📝 Summarizing pages", model=model)
+        )
+        
+        summarized_at = datetime.now().isoformat()
+        for page, response in zip(pages_data, responses):
             try:
-                print(f"\n📄 Processing Page {page['page_number']}")
-                
-                image_descriptions = ""
-                if page["images"]:
-                    descriptions = [img["educational_description"] for img in page["images"]]
-                    image_descriptions = "\n".join(descriptions)
-                    print(f"  🖼️ Including {len(page['images'])} image descriptions")
-                else:
-                    image_descriptions = "આ પાનામાં કોઈ ચિત્ર નથી."
-                    print("  📄 No images on this page")
-                
-                text_length = len(page["text"])
-                print(f"  📊 Text length: {text_length} characters")
-                
-                prompt = self.prompts["page_summarization"].format(
-                    page_text=page["text"],
-                    image_descriptions=image_descriptions
-                )
-                
-                print(f"  🔄 Sending to Gemini API...")
-                response = self.gemini_model.generate_content(prompt)
-                
-                self.api_calls["gemini_api"] += 1
+                if isinstance(response, Exception):
+                    raise response
+                page["page_summary"] = response
+                page["summarized_at"] = summarized_at
                 successful_summaries += 1
                 
-                page["page_summary"] = response.text
-                page["summarized_at"] = datetime.now().isoformat()
-                
-                summary_length = len(response.text)
-                print(f"  ✅ Summary generated ({summary_length} characters) - API call #{self.api_calls['gemini_api']}")
-                
-                time.sleep(1)
+                summary_length = len(response)
+                logger.debug(f"  ✅ Page {page['page_number']}: Summary generated ({summary_length} characters)")
             except Exception as e:
                 failed_summaries += 1
-                print(f"  ❌ Error: {str(e)[:100]}...")
+                logger.warning(f"  ❌ Page {page['page_number']}: Error: {str(e)[:100]}...")
                 page["page_summary"] = "સારાંશ ઉપલબ્ધ નથી"
         
         processing_time = time.time() - start_time
@@ -637,10 +1280,7 @@ class GSEBPDFProcessor:
                 page_summaries=summaries_text
             )
             
-            response = self.gemini_model.generate_content(prompt)
-            self.api_calls["gemini_api"] += 1
-            
-            analysis_text = response.text
+            analysis_text = self._generate_text(prompt, self._response_key(prompt))
             analysis_length = len(analysis_text)
             
             processing_time = time.time() - start_time
@@ -673,18 +1313,11 @@ class GSEBPDFProcessor:
         analysis = chapter_info["chapter_summary"]
         print(f"📊 Analyzing {len(analysis)} characters of chapter summary")
         
-        topics = []
-        lines = analysis.split('\n')
-        
         print("🔍 Searching for topics in chapter analysis...")
         
-        for line in lines:
-            line = line.strip()
-            if line and (line[0].isdigit() or line.startswith('- ')):
-                topic = line.lstrip('0123456789.- ').strip()
-                if topic and len(topic) > 5:
-                    topics.append(topic)
-                    print(f"  ✅ Topic {len(topics)}: {topic[:50]}...")
+        topics = _TOPIC_LINE_RE.findall(analysis)
+        for i, topic in enumerate(topics, 1):
+            logger.debug(f"  ✅ Topic {i}: {topic[:50]}...")
         
         print(f"\n📋 TOPIC EXTRACTION COMPLETED")
         print(f"🎯 Topics extracted: {len(topics)}")
@@ -723,50 +1356,100 @@ class GSEBPDFProcessor:
         failed_assignments = 0
         total_topic_assignments = 0
         
-        for page in tqdm(pages_data, desc="🏷️ Assigning topics"):
+        # Near-empty pages get no topics; near-duplicate pages (templated exercise pages,
+        # repeated headers) reuse the assignment of the first such page
+        assignments = {}
+        content_pages = []
+        for page in pages_data:
+            if len(re.sub(r"\s+", "", page["text"])) < self.min_topic_text_chars:
+                assignments[page["page_number"]] = []
+            else:
+                content_pages.append(page)
+        if assignments:
+            print(f"⏭️ {len(assignments)} near-empty pages skipped (no topics)")
+        
+        duplicate_of = self._near_duplicate_pages(content_pages)
+        unique_pages = [page for page in content_pages if page["page_number"] not in duplicate_of]
+        if duplicate_of:
+            print(f"♻️ {len(duplicate_of)} near-duplicate pages will reuse an earlier page's topics")
+        
+        # topic_batch_size pages per request (the topics list is sent once per batch),
+        # all batches sent concurrently
+        batches = [unique_pages[i:i + self.topic_batch_size] for i in range(0, len(unique_pages), self.topic_batch_size)]
+        prefix, tail = self._prompt_parts("topic_assignment_batch", topics_list=topics_string)
+        prompts = []
+        cache_keys = []
+        model = self.gemini_model
+        for batch in batches:
+            pages_block = "\n\n".join(
+                f"પાનું {page['page_number']}:\n{page['text'][:2000]}" for page in batch
+            )
+            model, prompt = self._cached_prompt(("topic_assignment_batch", topics_string), prefix, pages_block, tail)
+            prompts.append(prompt)
+            cache_keys.append(self._response_key(prefix, pages_block, tail, generation_config=self.topic_batch_config))
+        
+        responses = []
+        if prompts:
+            print(f"  🔄 Sending {len(prompts)} batched topic assignment requests ({len(unique_pages)} pages) to Gemini API...")
+            responses = self.loop.run_until_complete(
+                self._generate_all_async(prompts, cache_keys, desc="🏷️ Assigning topics", model=model,
+                                         generation_config=self.topic_batch_config, parse=self._parse_topic_batch)
+            )
+        
+        for batch, response in zip(batches, responses):
+            batch_page_numbers = {page["page_number"] for page in batch}
             try:
-                print(f"\n📄 Processing Page {page['page_number']}")
-                
-                text_length = len(page["text"])
-                text_sample = page["text"][:2000]
-                
-                print(f"  📊 Text length: {text_length} characters (using first 2000)")
-                
-                prompt = self.prompts["topic_assignment"].format(
-                    page_text=text_sample,
-                    topics_list=topics_string
-                )
-                
-                print(f"  🔄 Sending to Gemini API...")
-                response = self.gemini_model.generate_content(prompt)
-                
-                self.api_calls["gemini_api"] += 1
-                successful_assignments += 1
-                
-                topic_numbers = []
-                response_text = response.text.strip()
-                
-                print(f"  📝 AI Response: {response_text[:50]}...")
-                
-                for part in response_text.split(','):
-                    try:
-                        num = int(part.strip())
-                        if 1 <= num <= len(topics_list) and num not in topic_numbers:
-                            topic_numbers.append(num)
-                    except ValueError:
-                        continue
-                
-                page["assigned_topics"] = topic_numbers
-                page["topics_assigned_at"] = datetime.now().isoformat()
-                
-                total_topic_assignments += len(topic_numbers)
-                print(f"  ✅ Assigned {len(topic_numbers)} topics: {topic_numbers} - API call #{self.api_calls['gemini_api']}")
-                
-                time.sleep(1)
+                if isinstance(response, Exception):
+                    raise response
+                for item in response:
+                    if item["page_number"] in batch_page_numbers:
+                        assignments[item["page_number"]] = self._valid_topic_numbers(item["topic_numbers"], len(topics_list))
             except Exception as e:
+                logger.warning(f"  ⚠️ Batch for pages {batch[0]['page_number']}-{batch[-1]['page_number']} failed: {str(e)[:100]}...")
+        
+        # Pages missing from the batched replies fall back to one request each
+        retry_pages = [page for page in unique_pages if page["page_number"] not in assignments]
+        if retry_pages:
+            print(f"  🔁 Retrying {len(retry_pages)} pages with per-page requests...")
+            prefix, tail = self._prompt_parts("topic_assignment", topics_list=topics_string)
+            prompts = []
+            cache_keys = []
+            model = self.gemini_model
+            for page in retry_pages:
+                text_sample = page["text"][:2000]
+                model, prompt = self._cached_prompt(("topic_assignment", topics_string), prefix, text_sample, tail)
+                prompts.append(prompt)
+                cache_keys.append(self._response_key(prefix, text_sample, tail, generation_config=self.topic_list_config))
+            
+            responses = self.loop.run_until_complete(
+                self._generate_all_async(prompts, cache_keys, desc="🏷️ Assigning topics (per page)", model=model,
+                                         generation_config=self.topic_list_config, parse=self._parse_json_list)
+            )
+            for page, response in zip(retry_pages, responses):
+                try:
+                    if isinstance(response, Exception):
+                        raise response
+                    assignments[page["page_number"]] = self._valid_topic_numbers(response, len(topics_list))
+                except Exception as e:
+                    logger.warning(f"  ❌ Page {page['page_number']}: Error: {str(e)[:100]}...")
+        
+        for page_number, original_page_number in duplicate_of.items():
+            if original_page_number in assignments:
+                assignments[page_number] = assignments[original_page_number]
+        
+        topics_assigned_at = datetime.now().isoformat()
+        for page in pages_data:
+            if page["page_number"] not in assignments:
                 failed_assignments += 1
-                print(f"  ❌ Error: {str(e)[:100]}...")
                 page["assigned_topics"] = []
+                continue
+            
+            topic_numbers = assignments[page["page_number"]]
+            page["assigned_topics"] = topic_numbers
+            page["topics_assigned_at"] = topics_assigned_at
+            successful_assignments += 1
+            total_topic_assignments += len(topic_numbers)
+            logger.debug(f"  ✅ Page {page['page_number']}: Assigned {len(topic_numbers)} topics: {topic_numbers}")
         
         processing_time = time.time() - start_time
         avg_topics_per_page = total_topic_assignments / len(pages_data) if pages_data else 0
@@ -777,11 +1460,65 @@ class GSEBPDFProcessor:
         print(f"🎯 Total topic assignments: {total_topic_assignments}")
         print(f"📊 Average topics per page: {avg_topics_per_page:.1f}")
         print(f"⏱️ Processing time: {processing_time:.2f} seconds")
-        print(f"📊 Gemini API calls for topic assignment: {successful_assignments}")
+        print(f"📊 Gemini API calls for topic assignment: {len(batches) + len(retry_pages)}")
         print(f"📊 Total Gemini API calls so far: {self.api_calls['gemini_api']}")
         
         return pages_data
     
+    @staticmethod
+    def _text_shingles(text, size=5):
+        """Character shingles of text with whitespace collapsed and digits masked"""
+        text = re.sub(r"\d", "#", " ".join(text.split()))
+        return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+    
+    def _near_duplicate_pages(self, pages_data):
+        """Map each near-duplicate page's number to the number of the first page it matches"""
+        duplicate_of = {}
+        originals = []
+        first_page_by_sample = {}
+        for page in pages_data:
+            # Exact repeats are matched by a dict lookup, before any shingle comparison
+            sample = page["text"][:2000]
+            if sample in first_page_by_sample:
+                duplicate_of[page["page_number"]] = first_page_by_sample[sample]
+                continue
+            first_page_by_sample[sample] = page["page_number"]
+            
+            shingles = self._text_shingles(sample)
+            for original_page_number, original_shingles in originals:
+                union = len(shingles | original_shingles)
+                if union and len(shingles & original_shingles) / union >= self.topic_duplicate_similarity:
+                    duplicate_of[page["page_number"]] = original_page_number
+                    break
+            else:
+                originals.append((page["page_number"], shingles))
+        return duplicate_of
+    
+    @staticmethod
+    def _parse_json_list(text, length=None):
+        """A JSON-array reply (of exactly `length` items if given); raises ValueError otherwise"""
+        items = orjson.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON array")
+        if length is not None and len(items) != length:
+            raise ValueError(f"expected {length} items, got {len(items)}")
+        return items
+    
+    @classmethod
+    def _parse_topic_batch(cls, text):
+        """A batched topic-assignment reply: a JSON array of {page_number, topic_numbers} objects"""
+        items = cls._parse_json_list(text)
+        for item in items:
+            if (not isinstance(item, dict) or not isinstance(item.get("page_number"), int)
+                    or not isinstance(item.get("topic_numbers"), list)):
+                raise ValueError(f"malformed batch entry: {str(item)[:50]}")
+        return items
+    
+    @staticmethod
+    def _valid_topic_numbers(numbers, topic_count):
+        """Distinct in-range topic numbers, in reply order"""
+        return list(dict.fromkeys(num for num in numbers if 1 <= num <= topic_count))
+    
     def save_results(self, pdf_path, pages_data, chapter_info, topics_list):
         """Save all results to single JSON file"""
         print("\n" + "="*50)
@@ -789,45 +1526,6 @@ class GSEBPDFProcessor:
         print("="*50)
         
         processing_end_time = datetime.now()
-        total_processing_time = (processing_end_time - self.api_calls["start_time"]).total_seconds()
-        
-        total_images = sum(len(page.get('images', [])) for page in pages_data)
-        total_characters = sum(len(page.get('text', '')) for page in pages_data)
-        total_topic_assignments = sum(len(page.get('assigned_topics', [])) for page in pages_data)
-        
-        print(f"📊 FINAL PROCESSING STATISTICS:")
-        print(f"  📄 Total pages: {len(pages_data)}")
-        print(f"  🖼️ Total images: {total_images}")
-        print(f"  📝 Total characters extracted: {total_characters:,}")
-        print(f"  🎯 Total topics extracted: {len(topics_list)}")
-        print(f"  🏷️ Total topic assignments: {total_topic_assignments}")
-        print(f"  ⏱️ Total processing time: {total_processing_time:.2f} seconds")
-        
-        output_data = {
-            "metadata": {
-                "source_pdf": os.path.basename(pdf_path),
-                "board": "GSEB",
-                "class": 10,
-                "subject": "Mathematics",
-                "medium": "Gujarati",
-                "processed_at": processing_end_time.isoformat(),
-                "total_pages": len(pages_data),
-                "total_topics": len(topics_list),
-                "total_images": total_images,
-                "total_characters": total_characters,
-                "processing_time_seconds": round(total_processing_time, 2),
-                "api_usage": {
-                    "vision_api_calls": self.api_calls["vision_api"],
-                    "gemini_api_calls": self.api_calls["gemini_api"],
-                    "total_api_calls": self.api_calls["vision_api"] + self.api_calls["gemini_api"]
-                }
-            },
-            "chapter_info": {
-                **chapter_info,
-                "extracted_topics": topics_list
-            },
-            "pages": pages_data
-        }
         
         base_name = os.path.splitext(os.path.basename(pdf_path))[0]
         timestamp = processing_end_time.strftime("%Y%m%d_%H%M%S")
@@ -835,9 +1533,53 @@ class GSEBPDFProcessor:
         
         print(f"📁 Saving to file: {output_filename}")
         
+        # Totals are one cheap pass over the in-memory pages, so metadata and
+        # chapter_info are written first and the pages are then serialized one at a
+        # time rather than building and dumping the whole document
+        total_images = sum(len(page.get('images', [])) for page in pages_data)
+        total_characters = sum(len(page.get('text', '')) for page in pages_data)
+        total_topic_assignments = sum(len(page.get('assigned_topics', [])) for page in pages_data)
+        total_processing_time = (datetime.now() - self.api_calls["start_time"]).total_seconds()
+        
+        metadata = {
+            "source_pdf": os.path.basename(pdf_path),
+            "board": "GSEB",
+            "class": 10,
+            "subject": "Mathematics",
+            "medium": "Gujarati",
+            "processed_at": processing_end_time.isoformat(),
+            "total_pages": len(pages_data),
+            "total_topics": len(topics_list),
+            "total_images": total_images,
+            "total_characters": total_characters,
+            "processing_time_seconds": round(total_processing_time, 2),
+            "api_usage": {
+                "vision_api_calls": self.api_calls["vision_api"],
+                "gemini_api_calls": self.api_calls["gemini_api"],
+                "total_api_calls": self.api_calls["vision_api"] + self.api_calls["gemini_api"]
+            }
+        }
+        
         try:
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, ensure_ascii=False, indent=2)
+            with open(output_filename, 'wb') as f:
+                metadata_json = orjson.dumps(metadata, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  ')
+                chapter_json = orjson.dumps({**chapter_info, "extracted_topics": topics_list}, option=orjson.OPT_INDENT_2)
+                f.write(b'{\n  "metadata": ' + metadata_json
+                        + b',\n  "chapter_info": ' + chapter_json.replace(b'\n', b'\n  ') + b',\n  "pages": [')
+                
+                for i, page in enumerate(pages_data):
+                    f.write(b',\n    ' if i else b'\n    ')
+                    f.write(orjson.dumps(page, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n    '))
+                
+                f.write(b'\n  ]\n}\n')
+            
+            print(f"📊 FINAL PROCESSING STATISTICS:")
+            print(f"  📄 Total pages: {len(pages_data)}")
+            print(f"  🖼️ Total images: {total_images}")
+            print(f"  📝 Total characters extracted: {total_characters:,}")
+            print(f"  🎯 Total topics extracted: {len(topics_list)}")
+            print(f"  🏷️ Total topic assignments: {total_topic_assignments}")
+            print(f"  ⏱️ Total processing time: {total_processing_time:.2f} seconds")
             
             file_size = os.path.getsize(output_filename) / (1024 * 1024)
             
@@ -853,6 +1595,58 @@ class GSEBPDFProcessor:
             print(f"❌ Error saving file: {str(e)}")
             return None
     
+    def _checkpoint_path(self, run_key, stage):
+        return os.path.join(self.checkpoint_dir, f"{run_key}.{stage}.json")
+
+    def _run_stage(self, run_key, stage, func, *args):
+        """Return a stage's checkpointed output for this run if saved, else run it and checkpoint the result"""
+        path = self._checkpoint_path(run_key, stage)
+        try:
+            with open(path, 'rb') as f:
+                pages_data = orjson.loads(f.read())
+            print(f"♻️ Resuming from '{stage}' checkpoint ({len(pages_data)} pages)")
+            return pages_data
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            pass
+        
+        pages_data = func(*args)
+        if not pages_data:
+            return pages_data
+        
+        # Failed pages are carried forward by every later stage, so not checkpointing
+        # this stage also keeps the later ones from saving them; a rerun retries them
+        if self._has_failed_results(pages_data):
+            print(f"⚠️ Not checkpointing '{stage}': some pages failed and will be retried on the next run")
+            return pages_data
+        
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(pages_data))
+        os.replace(tmp_path, path)
+        return pages_data
+
+    @staticmethod
+    def _has_failed_results(pages_data):
+        """Whether any page holds an in-band failure: a failed Vision call, image description or summary"""
+        for page in pages_data:
+            # A page with no text at all is a real result, not a failed call
+            if page.get("error", "").startswith(("Vision API error", "No response data")):
+                return True
+            if page.get("page_summary") == "સારાંશ ઉપલબ્ધ નથી":
+                return True
+            if any(image.get("educational_description") == "વર્ણન ઉપલબ્ધ નથી" for image in page.get("images", [])):
+                return True
+        return False
+
+    def clear_checkpoints(self, run_key):
+        """Delete a finished run's stage checkpoints"""
+        for stage in ("extract", "describe", "integrate", "summarize"):
+            try:
+                os.remove(self._checkpoint_path(run_key, stage))
+            except FileNotFoundError:
+                pass
+
     def process_pdf(self, pdf_path):
         """Main processing pipeline with comprehensive logging and API counting"""
         print("\n" + "="*70)
@@ -864,21 +1658,27 @@ class GSEBPDFProcessor:
         print(f"📊 Initial API counters - Vision: 0, Gemini: 0")
         
         try:
+            # Checkpoints are keyed by the PDF's content and the chapter it is processed as
+            with open(pdf_path, 'rb') as f:
+                pdf_sha256 = hashlib.sha256(f.read()).hexdigest()
+            chapter_name = getattr(self, "current_chapter", "અજ્ઞાત અધ્યાય")
+            run_key = GeminiResponseCache.make_key(pdf_sha256, chapter_name)[:24]
+            
             # Step 1: Extract PDF pages with images
-            pages_data = self.extract_pdf_with_images(pdf_path)
+            pages_data = self._run_stage(run_key, "extract", self.extract_pdf_with_images, pdf_path)
             
             if not pages_data:
                 print("\n❌ PIPELINE FAILED: No pages extracted")
                 return None
             
             # Step 2: Generate AI descriptions for images/diagrams
-            pages_data = self.describe_images_with_ai(pages_data)
+            pages_data = self._run_stage(run_key, "describe", self.describe_images_with_ai, pages_data)
             
             # Step 3: Integrate image references into text
-            pages_data = self.integrate_images_in_text(pages_data)
+            pages_data = self._run_stage(run_key, "integrate", self.integrate_images_in_text, pages_data)
             
             # Step 4: Summarize each page (with image context)
-            pages_data = self.summarize_pages(pages_data)
+            pages_data = self._run_stage(run_key, "summarize", self.summarize_pages, pages_data)
             
             # Step 5: Analyze complete chapter
             chapter_info = self.analyze_chapter(pages_data)
@@ -896,6 +1696,8 @@ class GSEBPDFProcessor:
                 print("\n❌ PIPELINE FAILED: Could not save results")
                 return None
             
+            self.clear_checkpoints(run_key)
+            
             total_images = sum(len(page.get('images', [])) for page in pages_data)
             total_characters = sum(len(page.get('text', '')) for page in pages_data)
             
@@ -948,9 +1750,14 @@ class GSEBPDFProcessor:
             print("="*70)
             
             return None
+        finally:
+            # Context caches are billed while they live; drop them once the chapter is done
+            self.clear_prompt_caches()
 
 def main():
     """Main execution function"""
+    logging.basicConfig(level=os.getenv("GSEB_LOG", "INFO").upper(), format="%(message)s", stream=sys.stdout)
+    
     print("📚 GSEB Question Paper Generation System")
     print("🔧 PDF Processing Module - Class 10 Maths (Gujarati)")
     print("✨ With Image Recognition & Educational Descriptions")